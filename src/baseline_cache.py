@@ -0,0 +1,106 @@
+"""
+On-disk cache of baseline correction results, so reruns over unchanged chromatograms
+(e.g. when only peak detection parameters change) skip the baseline solve.
+
+Every chromatogram is one compressed .npz entry holding its baseline and corrected
+arrays, named after a hash of its intensity and retention time arrays, the method and
+the method parameters. The directory is kept under a size limit by evicting the least
+recently used entries (last read or write, tracked with the file mtime).
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+# bump when a baseline method changes its results, so older entries are no longer read
+CACHE_VERSION = 1
+
+
+class BaselineCache:
+    def __init__(self, cache_dir: str | Path, max_mb: float = 512):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.hits = self.misses = 0
+
+        # temporary files of writes interrupted by a crash (*.tmp.npz: written by earlier versions)
+        for path in [*self.cache_dir.glob("*.tmp"), *self.cache_dir.glob("*.tmp.npz")]:
+            path.unlink(missing_ok=True)
+
+        # entry -> (last use, size in bytes), least recently used first, and their total size;
+        # scanned once, then kept up to date by get, put and evict
+        entries = []
+        for path in self.cache_dir.glob("*.npz"):
+            stat = path.stat()
+            entries.append((path, (stat.st_mtime_ns, stat.st_size)))
+        self._entries = OrderedDict(sorted(entries, key=lambda item: item[1][0]))
+        self._size_bytes = sum(size for _, size in self._entries.values())
+
+    def __repr__(self):
+        return f"<BaselineCache>:(entries={len(self._entries)}, size={self.size_bytes / 1024 ** 2:.2f} MB, hits={self.hits}, misses={self.misses})"
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    @staticmethod
+    def key(method: str, intensity: np.ndarray, retention_time: np.ndarray | None, params: dict) -> str:
+        """Hash of the float64 intensity and retention time arrays, the method and its parameters."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps({"version": CACHE_VERSION, "method": method, "params": params},
+                                 sort_keys=True, default=str).encode())
+        for array in (intensity, retention_time):
+            array = np.ascontiguousarray(array if array is not None else [], dtype=np.float64)
+            digest.update(len(array).to_bytes(8, "little"))
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.npz"
+
+    def get(self, key: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """(baseline, corrected) of a cached entry, or None; a hit marks the entry as recently used."""
+        path = self._path(key)
+        if path not in self._entries:
+            self.misses += 1
+            return None
+
+        try:
+            with np.load(path) as entry:
+                baseline, corrected = entry["baseline"], entry["corrected"]
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            # removed or unreadable entry: drop it and solve again
+            self._size_bytes -= self._entries.pop(path)[1]
+            self.misses += 1
+            return None
+
+        self._entries[path] = (path.stat().st_mtime_ns, self._entries[path][1])
+        self._entries.move_to_end(path)
+        self.hits += 1
+        return baseline, corrected
+
+    def put(self, key: str, baseline: np.ndarray, corrected: np.ndarray):
+        """Writes an entry (atomically, through a temporary file) and evicts down to the size limit."""
+        path = self._path(key)
+        # written through a file object, so numpy keeps the name and the *.npz glob never sees it
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "wb") as tmp_file:
+            np.savez_compressed(tmp_file, baseline=baseline, corrected=corrected)
+        os.replace(tmp_path, path)
+
+        stat = path.stat()
+        previous = self._entries.pop(path, None)
+        self._size_bytes += stat.st_size - (previous[1] if previous is not None else 0)
+        self._entries[path] = (stat.st_mtime_ns, stat.st_size)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_mb."""
+        while self._size_bytes > self.max_bytes and self._entries:
+            path, (_, size) = self._entries.popitem(last=False)
+            path.unlink(missing_ok=True)
+            self._size_bytes -= size
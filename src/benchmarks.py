@@ -0,0 +1,557 @@
+"""
+Benchmarks comparing the optimized code paths against the original implementations.
+Each measured run happens in a fresh process so peak RSS is not shared between paths.
+
+Run from the repository root:
+    python -m src.benchmarks parse <file.mzML> --ms-level 1
+    python -m src.benchmarks readers <file.mzML> --ms-level 1
+    python -m src.benchmarks chunks <file.mzML> --ms-level 1 --workers 1 2 4
+    python -m src.benchmarks xic-cache <file.parquet> 289.0718 --ppm 3
+    python -m src.benchmarks xic-index <file.parquet> --targets 2000 --ppm 3
+    python -m src.benchmarks raw-memory <file.parquet>
+    python -m src.benchmarks qc <file.parquet>
+    python -m src.benchmarks baseline --chromatograms 1000 --scans 1000
+    python -m src.benchmarks baseline-methods --chromatograms 1000 --scans 1000
+    python -m src.benchmarks deconvolution --peaks 1 2 3 5
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_isolated(func, *args, **kwargs):
+    """Runs func(*args, **kwargs) in a fresh spawned process and returns its result."""
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(func, *args, **kwargs).result()
+
+
+def print_results(title: str, results: list[dict]):
+    print(f"\t> {title}")
+    for r in results:
+        line = ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in r.items())
+        print(f"\t  {line}")
+
+
+## ------------------- ##
+## mzML parsing
+## ------------------- ##
+
+def _timed_parse(mzml_file: str | Path, parse_mode: str, ms_level: int, **parser_cfg) -> dict:
+    import pyarrow.parquet as pq
+    from src.preprocess import MzmlParser
+
+    parser = MzmlParser(Path(mzml_file), rerun=True, run_id=None, ms_level=ms_level, **parser_cfg)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    if parse_mode == "stream":
+        with tempfile.TemporaryDirectory() as tmp:
+            n_rows = pq.ParquetFile(parser.stream_to_parquet(Path(tmp) / "stream.parquet")).metadata.num_rows
+    else:
+        n_rows = len(parser.parse_mzml_file(parse_mode=parse_mode))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "parse_mode": parse_mode,
+        "rows": n_rows,
+        "seconds": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "parse_rss_mb": peak_rss_mb() - rss_before,
+    }
+
+
+def benchmark_parse_modes(mzml_file: str | Path, ms_level: int = 1, modes=("rows", "columnar", "stream"), **parser_cfg) -> list[dict]:
+    """
+    Parse time and peak RSS of MzmlParser.parse_mzml_file for each parse mode,
+    'stream' measures the streaming parquet writer instead.
+    """
+    results = [run_isolated(_timed_parse, mzml_file, mode, ms_level, **parser_cfg) for mode in modes]
+    print_results(f"Parsing {Path(mzml_file).name}", results)
+    return results
+
+
+def benchmark_readers(mzml_file: str | Path, ms_level: int = 1) -> list[dict]:
+    """
+    Columnar parse time and peak RSS with the pymzml reader against the fast
+    iterparse/np.frombuffer reader, and whether both produce the same peak table.
+    """
+    import pandas as pd
+    from src.preprocess import MzmlParser
+
+    results = [{"reader": reader, **run_isolated(_timed_parse, mzml_file, "columnar", ms_level, reader=reader)}
+               for reader in ("pymzml", "fast")]
+
+    frames = [MzmlParser(Path(mzml_file), rerun=True, run_id=None, ms_level=ms_level, reader=reader).parse_mzml_file()
+              for reader in ("pymzml", "fast")]
+    try:
+        pd.testing.assert_frame_equal(*frames, check_dtype=False)
+        same = True
+    except AssertionError:
+        same = False
+    for r in results:
+        r["same_peaks"] = same
+
+    print_results(f"Readers on {Path(mzml_file).name}", results)
+    return results
+
+
+def benchmark_chunk_workers(mzml_file: str | Path, ms_level: int = 1, workers=(1, 2, 4)) -> list[dict]:
+    """
+    Parse time of a single file decoded in byte-range chunks by 'chunk_workers'
+    processes, and whether every run produced the same peak table as the serial one.
+    """
+    from src.preprocess import MzmlParser
+
+    results = [{"chunk_workers": n, **run_isolated(_timed_parse, mzml_file, "columnar", ms_level, reader="fast", chunk_workers=n)}
+               for n in workers]
+
+    serial = MzmlParser(Path(mzml_file), rerun=True, run_id=None, ms_level=ms_level, reader="fast").parse_mzml_file()
+    for r in results:
+        frame = MzmlParser(Path(mzml_file), rerun=True, run_id=None, ms_level=ms_level, reader="fast",
+                           chunk_workers=r["chunk_workers"]).parse_mzml_file()
+        r["same_peaks"] = frame.equals(serial)
+
+    print_results(f"Chunked parsing of {Path(mzml_file).name}", results)
+    return results
+
+
+## ------------------- ##
+## XIC from parquet cache
+## ------------------- ##
+
+def _timed_xic(parquet_path: Path, mz_value: float, tol: float, pushdown: bool) -> dict:
+    from src.preprocess import read_cache, read_mz_window
+
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    if pushdown:
+        hits = read_mz_window(parquet_path, mz_value - tol, mz_value + tol, columns=["scan_idx", "intensity", "mz"])
+    else:
+        raw = read_cache(parquet_path)
+        hits = raw[(raw["mz"] >= mz_value - tol) & (raw["mz"] <= mz_value + tol)]
+    elapsed = time.perf_counter() - start
+
+    return {
+        "path": "pushdown" if pushdown else "full_load",
+        "hits": len(hits),
+        "seconds": elapsed,
+        "read_rss_mb": peak_rss_mb() - rss_before,
+    }
+
+
+def benchmark_xic_from_cache(parquet_path: str | Path, mz_value: float, ppm: float = 3, row_group_size: int = 100_000) -> list[dict]:
+    """
+    Targeted XIC read from a cache: full load + mask against pyarrow filter pushdown,
+    on retention time and m/z sorted copies of the given parquet cache.
+    """
+    from src.preprocess import read_cache, write_parquet_cache
+
+    tol = ppm * mz_value / 1e6
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = read_cache(Path(parquet_path))
+        for cache_sort in ("retention_time", "mz"):
+            path = Path(tmp) / f"{cache_sort}.parquet"
+            write_parquet_cache(raw, path, row_group_size, cache_sort)
+            for pushdown in (False, True):
+                result = run_isolated(_timed_xic, path, mz_value, tol, pushdown)
+                results.append({"cache_sort": cache_sort, **result})
+
+    print_results(f"XIC {mz_value} ± {ppm} ppm from {Path(parquet_path).name}", results)
+    return results
+
+
+def benchmark_xic_index(parquet_path: str | Path, n_targets: int = 2000, ppm: float = 3, seed: int = 0) -> list[dict]:
+    """
+    Peak lookup for n_targets random m/z windows: one boolean mask over raw per target
+    against one m/z sort (MzIndex) plus two binary searches per target.
+    """
+    import numpy as np
+    from src.preprocess import read_cache
+    from src.spectrum_store import MzIndex
+
+    mz = read_cache(Path(parquet_path), columns=["mz"])["mz"].to_numpy()
+    targets = np.random.default_rng(seed).uniform(mz.min(), mz.max(), n_targets)
+    tolerances = ppm * targets / 1e6
+
+    start = time.perf_counter()
+    masked = [np.flatnonzero((mz >= t - tol) & (mz <= t + tol)) for t, tol in zip(targets, tolerances)]
+    mask_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = MzIndex(mz)
+    build_seconds = time.perf_counter() - start
+    indexed = [index.window(t - tol, t + tol) for t, tol in zip(targets, tolerances)]
+    index_seconds = time.perf_counter() - start
+
+    results = [
+        {"path": "mask", "targets": n_targets, "seconds": mask_seconds},
+        {"path": "searchsorted", "targets": n_targets, "seconds": index_seconds, "build_seconds": build_seconds,
+         "same_peaks": all(np.array_equal(a, b) for a, b in zip(masked, indexed))},
+    ]
+    print_results(f"XIC window lookups on {Path(parquet_path).name} ({len(mz)} peaks)", results)
+    return results
+
+
+## ------------------- ##
+## Compact SampleData.raw
+## ------------------- ##
+
+def benchmark_raw_memory(parquet_path: str | Path) -> list[dict]:
+    """In-memory size and load time of SampleData.raw, full peak table against the compact one."""
+    from src.preprocess import load_cached_sample
+
+    results = []
+    for compact in (False, True):
+        start = time.perf_counter()
+        raw, scans = load_cached_sample(Path(parquet_path), compact=compact)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "raw": "compact" if compact else "full",
+            "columns": len(raw.columns),
+            "seconds": elapsed,
+            "raw_mb": raw.memory_usage(deep=True).sum() / 1024 ** 2,
+            "scans_mb": scans.memory_usage(deep=True).sum() / 1024 ** 2,
+        })
+
+    print_results(f"SampleData.raw memory for {Path(parquet_path).name}", results)
+    return results
+
+
+## ------------------- ##
+## Quality control
+## ------------------- ##
+
+def qc_groupby(raw, scans=None):
+    """Original SampleData.qc_df: groupby reductions per scan merged onto the scan table."""
+    if 'scan_id' in raw.columns:
+        quality_control_base, key = raw[['scan_id', 'retention_time']].drop_duplicates(), 'scan_id'
+    else:
+        quality_control_base, key = scans.loc[scans['n_peaks'] > 0, ['scan_idx', 'scan_id', 'retention_time']], 'scan_idx'
+
+    tic = raw.groupby(key)['intensity'].sum().reset_index(name='tic')
+    bpc = raw.groupby(key)['intensity'].max().reset_index(name='bpc')
+    pps = raw.groupby(key).size().rename('peaks_per_scan').reset_index()
+    bpc_mz = (raw.loc[raw.groupby(key)['intensity'].idxmax(), [key, 'mz']].reset_index(drop=True).rename(columns={'mz': 'bpc_mz'}))
+
+    return (
+        quality_control_base
+        .merge(tic, on=key)
+        .merge(bpc, on=key)
+        .merge(pps, on=key)
+        .merge(bpc_mz, on=key)
+        .drop(columns='scan_idx', errors='ignore')
+    )
+
+
+def benchmark_qc(parquet_path: str | Path, repeats: int = 3) -> list[dict]:
+    """
+    Best of 'repeats' run times of the groupby quality control against the
+    reduceat kernel of SampleData.qc_df, on the full and the compact raw table.
+    """
+    import pandas as pd
+    from src.preprocess import load_cached_sample
+    from src.sampleData import SampleData
+
+    results = []
+    for compact in (False, True):
+        raw, scans = load_cached_sample(Path(parquet_path), compact=compact)
+        sample = SampleData(unique_id=Path(parquet_path).stem, raw=raw, scans=scans)
+
+        timings = {}
+        for name, func in (("groupby", lambda: qc_groupby(raw, scans)), ("reduceat", sample._qc_kernel)):
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                frame = func()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = (best, frame)
+
+        try:
+            pd.testing.assert_frame_equal(timings["groupby"][1].reset_index(drop=True), timings["reduceat"][1])
+            same = True
+        except AssertionError:
+            same = False
+
+        results.append({
+            "raw": "compact" if compact else "full",
+            "scans": len(timings["reduceat"][1]),
+            "groupby_seconds": timings["groupby"][0],
+            "reduceat_seconds": timings["reduceat"][0],
+            "speedup": timings["groupby"][0] / timings["reduceat"][0],
+            "same_frame": same,
+        })
+
+    print_results(f"Quality control of {Path(parquet_path).name}", results)
+    return results
+
+
+## ------------------- ##
+## Baseline correction
+## ------------------- ##
+
+def asls_spsolve(y, lam=1e6, p=0.1, niter=10):
+    """Original BaselineCorrection.asls: sparse W + lam * DTD rebuilt and solved with spsolve, always niter times."""
+    import numpy as np
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+
+    L = len(y)
+    w = np.ones(L)
+    D = sparse.diags([1.0, -2.0, 1.0], [0, -1, -2], shape=(L, L - 2), format='csr')
+    DTD = D @ D.T
+    for _ in range(niter):
+        W = sparse.spdiags(w, 0, L, L)
+        z = spsolve(W + lam * DTD, W @ y)
+        w = p * (y > z) + (1 - p) * (y < z)
+    return z
+
+
+def synthetic_xics(n_chromatograms: int, n_scans: int, seed: int = 0, with_drift: bool = False):
+    """Drifting baselines with a few gaussian peaks and noise, one row per chromatogram (and the true drift)."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, n_scans)
+    drift = rng.uniform(1e3, 1e4, (n_chromatograms, 1)) * (1 + rng.uniform(-0.5, 0.5, (n_chromatograms, 1)) * x)
+    peaks = np.zeros((n_chromatograms, n_scans))
+    for _ in range(3):
+        centre, width = rng.uniform(0.1, 0.9, (n_chromatograms, 1)), rng.uniform(0.002, 0.01, (n_chromatograms, 1))
+        peaks += rng.uniform(1e4, 1e6, (n_chromatograms, 1)) * np.exp(-0.5 * ((x - centre) / width) ** 2)
+    xics = np.maximum(drift + peaks + rng.normal(0, 100, (n_chromatograms, n_scans)), 0)
+    return (xics, drift) if with_drift else xics
+
+
+def benchmark_baseline(n_chromatograms: int = 1000, n_scans: int = 1000, n_original: int = 50, **asls_params) -> list[dict]:
+    """
+    AsLS throughput on synthetic XICs: the original spsolve loop (timed on the first
+    n_original chromatograms and scaled), the banded asls per chromatogram and asls_batch.
+    """
+    import numpy as np
+    from src.correct_baseline import BaselineCorrection
+
+    Y = synthetic_xics(n_chromatograms, n_scans)
+    bc = BaselineCorrection()
+
+    start = time.perf_counter()
+    original = np.vstack([asls_spsolve(y) for y in Y[:n_original]])
+    spsolve_seconds = (time.perf_counter() - start) * n_chromatograms / n_original
+
+    start = time.perf_counter()
+    looped = np.vstack([bc.asls(y, **asls_params)[0] for y in Y])
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = bc.asls_batch(Y, **asls_params)[0]
+    batch_seconds = time.perf_counter() - start
+
+    scale = np.abs(original).max()
+    results = [
+        {"path": "spsolve", "seconds": spsolve_seconds, "xic_per_second": n_chromatograms / spsolve_seconds},
+        {"path": "banded loop", "seconds": loop_seconds, "xic_per_second": n_chromatograms / loop_seconds,
+         "max_rel_diff": float(np.abs(looped[:n_original] - original).max() / scale)},
+        {"path": "banded batch", "seconds": batch_seconds, "xic_per_second": n_chromatograms / batch_seconds,
+         "max_rel_diff": float(np.abs(batched[:n_original] - original).max() / scale),
+         "same_as_loop": bool(np.allclose(batched, looped, rtol=1e-9, atol=1e-6))},
+    ]
+    print_results(f"AsLS baseline of {n_chromatograms} XICs x {n_scans} scans", results)
+    return results
+
+
+def benchmark_baseline_methods(n_chromatograms: int = 1000, n_scans: int = 1000, methods=None, repeats: int = 3) -> list[dict]:
+    """
+    Best of 'repeats' run times of every registered baseline method on the same synthetic
+    XICs, with the RMS error against the true drift relative to its mean, using the
+    parameters of config/config.yaml. The XICs get a retention time axis on which the
+    configured SNIP window is the base width (4 sigma) of the widest synthetic peak,
+    so SNIP clips the peaks as it would on real data.
+    """
+    import numpy as np
+    import yaml
+    from src.correct_baseline import BASELINE_METHODS, BaselineCorrection
+    config_path = Path(__file__).resolve().parents[1] / "config" / "config.yaml"
+    baseline_cfg = yaml.safe_load(open(config_path)).get("baseline", {})
+    Y, drift = synthetic_xics(n_chromatograms, n_scans, with_drift=True)
+    # synthetic peaks are at most 0.01 of the run wide (sigma), see synthetic_xics
+    snip_window = (baseline_cfg.get("snip") or {}).get("window", 5)
+    retention_time = np.linspace(0, snip_window / 0.04, n_scans)
+    bc = BaselineCorrection()
+
+    results = []
+    for method in methods or BASELINE_METHODS:
+        params = baseline_cfg.get(method) or {}
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            baselines, _ = bc.correct(method, Y, retention_time=retention_time, **params)
+            best = min(best, time.perf_counter() - start)
+        results.append({
+            "method": method,
+            "seconds": best,
+            "xic_per_second": n_chromatograms / best,
+            "rel_rms_error": float(np.sqrt(((baselines - drift) ** 2).mean()) / drift.mean()),
+        })
+
+    print_results(f"Baseline methods on {n_chromatograms} XICs x {n_scans} scans", results)
+    return results
+
+
+## ------------------- ##
+## Peak deconvolution
+## ------------------- ##
+
+def sum_skewnorms_scipy(x, *params):
+    """Original helpers.sum_skewnorms: one scipy.stats.skewnorm.pdf call per peak."""
+    import numpy as np
+    from scipy.stats import skewnorm
+
+    y = np.zeros_like(x)
+    for i in range(len(params) // 4):
+        a, loc, scale, skew = params[i * 4:(i + 1) * 4]
+        y += skewnorm.pdf(x, skew, loc, scale) * a
+    return y
+
+
+def synthetic_window(n_peaks: int, n_points: int = 400, seed: int = 0):
+    """Overlapping skew-normal peaks with noise, and the DetectPeaks style start values and bounds."""
+    import numpy as np
+    from src.helpers import default_param_bounds, sum_skewnorms
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 2 * n_peaks, n_points)
+    true = np.column_stack([rng.uniform(1e4, 1e5, n_peaks), 1 + 2 * np.arange(n_peaks) + rng.uniform(-0.3, 0.3, n_peaks),
+                            rng.uniform(0.3, 0.8, n_peaks), rng.uniform(-3, 3, n_peaks)]).ravel()
+    signal = sum_skewnorms(x, *true)
+    signal = signal + rng.normal(0, 0.01 * signal.max(), n_points)
+
+    p0, lower, upper = [], [], []
+    for a, loc, scale, _ in true.reshape(-1, 4):
+        bounds = default_param_bounds(a, x.min(), x.max())
+        p0 += [a * rng.uniform(0.7, 1.3), loc + rng.uniform(-0.2, 0.2), scale * rng.uniform(0.7, 1.3), 0]
+        lower += [bounds["amplitude"][0], x.min(), 0, -5]
+        upper += [bounds["amplitude"][1], x.max(), (x.max() - x.min()) / 2, 5]
+    return x, signal, np.clip(p0, lower, upper), (lower, upper)
+
+
+def benchmark_deconvolution(peaks=(1, 2, 3, 5), repeats: int = 3, max_niter: int = 200000) -> list[dict]:
+    """
+    Best of 'repeats' curve_fit times per window for the original per-peak scipy.stats model
+    with finite difference derivatives against the broadcast model with its analytic Jacobian.
+    """
+    import numpy as np
+    import scipy.optimize
+    from src.helpers import sum_skewnorms, sum_skewnorms_jacobian
+
+    results = []
+    for n_peaks in peaks:
+        x, signal, p0, bounds = synthetic_window(n_peaks, seed=n_peaks)
+        fits = {}
+        for name, model, jac in (("scipy", sum_skewnorms_scipy, None), ("analytic", sum_skewnorms, sum_skewnorms_jacobian)):
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                popt, _, infodict, _, _ = scipy.optimize.curve_fit(model, x, signal, p0=p0, bounds=bounds, jac=jac,
+                                                                   maxfev=max_niter, full_output=True)
+                best = min(best, time.perf_counter() - start)
+            fits[name] = (best, int(infodict["nfev"]), sum_skewnorms(x, *popt))
+
+        results.append({
+            "peaks": n_peaks,
+            "scipy_seconds": fits["scipy"][0],
+            "scipy_nfev": fits["scipy"][1],
+            "analytic_seconds": fits["analytic"][0],
+            "analytic_nfev": fits["analytic"][1],
+            "speedup": fits["scipy"][0] / fits["analytic"][0],
+            "max_rel_curve_diff": float(np.abs(fits["scipy"][2] - fits["analytic"][2]).max() / signal.max()),
+        })
+
+    print_results("Skew-normal deconvolution fits per window", results)
+    return results
+
+
+##==============================##
+## Command Line Interface (CLI) ##
+##==============================##
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Ionome benchmarks.')
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parse_cmd = subparsers.add_parser("parse", help="Compare mzML parse modes")
+    parse_cmd.add_argument("mzml_file", type=Path)
+    parse_cmd.add_argument("--ms-level", type=int, default=1)
+    parse_cmd.add_argument("--row-group-size", type=int, default=1_000_000)
+
+    readers_cmd = subparsers.add_parser("readers", help="Compare the pymzml and fast mzML readers")
+    readers_cmd.add_argument("mzml_file", type=Path)
+    readers_cmd.add_argument("--ms-level", type=int, default=1)
+
+    chunks_cmd = subparsers.add_parser("chunks", help="Compare parse times of one file split across chunk workers")
+    chunks_cmd.add_argument("mzml_file", type=Path)
+    chunks_cmd.add_argument("--ms-level", type=int, default=1)
+    chunks_cmd.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+
+    xic_cmd = subparsers.add_parser("xic-cache", help="Compare full load and pushdown XIC reads from a parquet cache")
+    xic_cmd.add_argument("parquet_path", type=Path)
+    xic_cmd.add_argument("mz", type=float)
+    xic_cmd.add_argument("--ppm", type=float, default=3)
+    xic_cmd.add_argument("--row-group-size", type=int, default=100_000)
+
+    xic_index_cmd = subparsers.add_parser("xic-index", help="Compare masked and m/z index lookups for many XIC targets")
+    xic_index_cmd.add_argument("parquet_path", type=Path)
+    xic_index_cmd.add_argument("--targets", type=int, default=2000)
+    xic_index_cmd.add_argument("--ppm", type=float, default=3)
+
+    raw_cmd = subparsers.add_parser("raw-memory", help="Compare full and compact SampleData.raw memory")
+    raw_cmd.add_argument("parquet_path", type=Path)
+
+    qc_cmd = subparsers.add_parser("qc", help="Compare the groupby and reduceat quality control")
+    qc_cmd.add_argument("parquet_path", type=Path)
+
+    baseline_cmd = subparsers.add_parser("baseline", help="Compare AsLS baseline throughput: spsolve, banded loop, banded batch")
+    baseline_cmd.add_argument("--chromatograms", type=int, default=1000)
+    baseline_cmd.add_argument("--scans", type=int, default=1000)
+
+    methods_cmd = subparsers.add_parser("baseline-methods", help="Compare run time and accuracy of the registered baseline methods")
+    methods_cmd.add_argument("--chromatograms", type=int, default=1000)
+    methods_cmd.add_argument("--scans", type=int, default=1000)
+    methods_cmd.add_argument("--methods", nargs="+", default=None)
+
+    deconvolution_cmd = subparsers.add_parser("deconvolution", help="Compare skew-normal fits with numeric and analytic Jacobians")
+    deconvolution_cmd.add_argument("--peaks", type=int, nargs="+", default=[1, 2, 3, 5])
+
+    args = parser.parse_args()
+
+    if args.benchmark == "parse":
+        benchmark_parse_modes(args.mzml_file, ms_level=args.ms_level, row_group_size=args.row_group_size)
+    elif args.benchmark == "readers":
+        benchmark_readers(args.mzml_file, ms_level=args.ms_level)
+    elif args.benchmark == "chunks":
+        benchmark_chunk_workers(args.mzml_file, ms_level=args.ms_level, workers=args.workers)
+    elif args.benchmark == "xic-cache":
+        benchmark_xic_from_cache(args.parquet_path, args.mz, ppm=args.ppm, row_group_size=args.row_group_size)
+    elif args.benchmark == "xic-index":
+        benchmark_xic_index(args.parquet_path, n_targets=args.targets, ppm=args.ppm)
+    elif args.benchmark == "raw-memory":
+        benchmark_raw_memory(args.parquet_path)
+    elif args.benchmark == "qc":
+        benchmark_qc(args.parquet_path)
+    elif args.benchmark == "baseline":
+        benchmark_baseline(n_chromatograms=args.chromatograms, n_scans=args.scans)
+    elif args.benchmark == "baseline-methods":
+        benchmark_baseline_methods(n_chromatograms=args.chromatograms, n_scans=args.scans, methods=args.methods)
+    elif args.benchmark == "deconvolution":
+        benchmark_deconvolution(peaks=args.peaks)
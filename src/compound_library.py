@@ -0,0 +1,194 @@
+"""
+Compound library: a CSV/TSV/XLSX table of compounds expanded into one XIC target
+per (compound, adduct, isotope), with their m/z tolerance windows precomputed as
+sorted arrays and merged into non-overlapping intervals.
+
+The expanded library is cached per project as parquet in the cached directory and
+reused while the source table and the expansion settings are unchanged.
+"""
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.xic_matrix import merge_windows, target_windows
+
+REQUIRED_LIBRARY_COLUMNS = {"name"}
+MASS_COLUMNS = ("monoisotopic_mass", "formula")
+
+ELECTRON_MASS = 0.000548579909
+PROTON_MASS = 1.007276466812
+C13_SPACING = 1.0033548378
+
+# Monoisotopic masses of the elements accepted in formulas
+ELEMENT_MASSES = {
+    "H": 1.00782503207, "C": 12.0, "N": 14.0030740048, "O": 15.99491461956, "P": 30.97376163,
+    "S": 31.97207100, "F": 18.99840322, "Cl": 34.96885268, "Br": 78.9183371, "I": 126.904473,
+    "Na": 22.9897692809, "K": 38.96370668, "Si": 27.9769265325, "Se": 79.9165213, "B": 11.0093054,
+    "Mg": 23.985041700, "Ca": 39.96259098, "Fe": 55.9349375, "Cu": 62.9295975, "Zn": 63.9291422,
+}
+
+# adduct: (molecules M, charge, mass added to n * M before dividing by |charge|)
+ADDUCTS = {
+    "[M+H]+": (1, 1, PROTON_MASS),
+    "[M+Na]+": (1, 1, ELEMENT_MASSES["Na"] - ELECTRON_MASS),
+    "[M+K]+": (1, 1, ELEMENT_MASSES["K"] - ELECTRON_MASS),
+    "[M+NH4]+": (1, 1, ELEMENT_MASSES["N"] + 4 * ELEMENT_MASSES["H"] - ELECTRON_MASS),
+    "[M+2H]2+": (1, 2, 2 * PROTON_MASS),
+    "[2M+H]+": (2, 1, PROTON_MASS),
+    "[M-H]-": (1, -1, -PROTON_MASS),
+    "[M+Cl]-": (1, -1, ELEMENT_MASSES["Cl"] + ELECTRON_MASS),
+    "[M+FA-H]-": (1, -1, ELEMENT_MASSES["C"] + 2 * ELEMENT_MASSES["H"] + 2 * ELEMENT_MASSES["O"] - PROTON_MASS),
+    "[M-2H]2-": (1, -2, -2 * PROTON_MASS),
+    "[2M-H]-": (2, -1, -PROTON_MASS),
+}
+
+FORMULA_PATTERN = re.compile(r"([A-Z][a-z]?)(\d*)")
+
+
+def formula_mass(formula: str) -> float:
+    """Monoisotopic mass of a molecular formula such as 'C15H14O6'."""
+    formula = str(formula).strip()
+    if not formula or "".join(m.group(0) for m in FORMULA_PATTERN.finditer(formula)) != formula:
+        raise ValueError(f"Cannot parse formula: {formula!r}")
+
+    mass = 0.0
+    for element, count in FORMULA_PATTERN.findall(formula):
+        if element not in ELEMENT_MASSES:
+            raise ValueError(f"Unknown element '{element}' in formula {formula}")
+        mass += ELEMENT_MASSES[element] * (int(count) if count else 1)
+    return mass
+
+
+def load_library_table(path: str | Path) -> pd.DataFrame:
+    """Reads a compound table with a 'name' column and a 'monoisotopic_mass' or 'formula' column."""
+    path = Path(path)
+
+    if not path.exists():
+        raise FileNotFoundError(path)
+
+    if path.suffix == ".xlsx":
+        df = pd.read_excel(path)
+    elif path.suffix in {".csv", ".tsv"}:
+        seperator = "\t" if path.suffix == ".tsv" else ","
+        df = pd.read_csv(path, sep=seperator)
+    else:
+        raise ValueError(f"Unsupported file extension: {path.suffix}")
+
+    missing_columns = REQUIRED_LIBRARY_COLUMNS - set(df.columns)
+
+    if missing_columns:
+        raise ValueError(f"Missing columns: {missing_columns}")
+    if not any(column in df.columns for column in MASS_COLUMNS):
+        raise ValueError(f"Missing columns: one of {set(MASS_COLUMNS)}")
+
+    return df
+
+
+def compound_masses(df: pd.DataFrame) -> np.ndarray:
+    """Monoisotopic mass per compound, from 'monoisotopic_mass' where given, else computed from 'formula'."""
+    masses = pd.to_numeric(df["monoisotopic_mass"], errors="coerce") if "monoisotopic_mass" in df.columns \
+        else pd.Series(np.nan, index=df.index)
+    if "formula" in df.columns:
+        missing = masses.isna() & df["formula"].notna()
+        masses[missing] = df.loc[missing, "formula"].map(formula_mass)
+
+    if masses.isna().any():
+        raise ValueError(f"No mass or formula for compounds: {', '.join(df.loc[masses.isna(), 'name'].astype(str))}")
+    return masses.to_numpy(dtype=np.float64)
+
+
+def expand_library(df: pd.DataFrame, adducts: list[str], isotopes: int, tol: float, tol_type: str) -> pd.DataFrame:
+    """
+    One row per (compound, adduct, isotope) with its target name, m/z and tolerance window,
+    sorted by the window's lower bound. Isotope n is the 13C isotopologue M+n.
+    """
+    unknown = [adduct for adduct in adducts if adduct not in ADDUCTS]
+    if unknown:
+        raise ValueError(f"Unknown adducts: {unknown}, known: {list(ADDUCTS)}")
+
+    masses = compound_masses(df)
+    names = df["name"].astype(str).to_numpy()
+    isotope_numbers = np.arange(int(isotopes) + 1)
+
+    frames = []
+    for adduct in adducts:
+        n_molecules, charge, shift = ADDUCTS[adduct]
+        mz = (n_molecules * masses + shift) / abs(charge)
+        # compounds x isotopes, compound major
+        mz = mz[:, None] + isotope_numbers[None, :] * C13_SPACING / abs(charge)
+        frames.append(pd.DataFrame({
+            "compound": np.repeat(names, len(isotope_numbers)),
+            "adduct": adduct,
+            "isotope": np.tile(isotope_numbers, len(names)),
+            "mz": mz.ravel(),
+        }))
+
+    library = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["compound", "adduct", "isotope", "mz"])
+    library.insert(0, "target", [f"{c} {a}" if i == 0 else f"{c} {a} M+{i}"
+                                 for c, a, i in zip(library["compound"], library["adduct"], library["isotope"])])
+
+    lower, upper = target_windows(dict(zip(library["target"], library["mz"])), tol, tol_type)
+    if len(lower) != len(library):
+        raise ValueError("Duplicate compound names in library")
+    library["mz_min"], library["mz_max"] = lower, upper
+
+    return library.sort_values("mz_min", kind="stable", ignore_index=True)
+
+
+class CompoundLibrary:
+    def __init__(self, library: pd.DataFrame):
+        self.library = library.reset_index(drop=True)
+        self.lower = self.library["mz_min"].to_numpy()
+        self.upper = self.library["mz_max"].to_numpy()
+        self.interval_lower, self.interval_upper, self.interval = merge_windows(self.lower, self.upper)
+
+    def __len__(self) -> int:
+        return len(self.library)
+
+    def __repr__(self):
+        return (f"<CompoundLibrary>:(compounds={self.library['compound'].nunique()}, targets={len(self)}, "
+                f"intervals={len(self.interval_lower)})")
+
+    @property
+    def target_list(self) -> dict[str, float]:
+        """{target name: m/z}, the same shape as config target_mz_list."""
+        return dict(zip(self.library["target"], self.library["mz"]))
+
+    @classmethod
+    def load(cls,
+             path: str | Path,
+             adducts: list[str],
+             isotopes: int,
+             tol: float,
+             tol_type: str,
+             cache_dir: Path | None = None) -> "CompoundLibrary":
+        """
+        Loads and expands a compound table. With cache_dir, the expanded library is read
+        from (or written to) library_<name>.parquet there; the cache is reused while the
+        table's size and mtime and the expansion settings match its stored metadata.
+        """
+        path = Path(path)
+        stat = path.stat()
+        settings = json.dumps({"source": path.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                               "adducts": list(adducts), "isotopes": int(isotopes), "tol": float(tol),
+                               "tol_type": tol_type}, sort_keys=True).encode()
+
+        cache_path = cache_dir / f"library_{path.stem}.parquet" if cache_dir is not None else None
+        if cache_path is not None and cache_path.exists():
+            table = pq.read_table(cache_path)
+            if (table.schema.metadata or {}).get(b"ionome_library") == settings:
+                return cls(table.to_pandas())
+
+        library = expand_library(load_library_table(path), adducts, isotopes, tol, tol_type)
+
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(library, preserve_index=False)
+            pq.write_table(table.replace_schema_metadata({**(table.schema.metadata or {}), b"ionome_library": settings}), cache_path)
+
+        return cls(library)
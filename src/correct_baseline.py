@@ -2,7 +2,10 @@
 Class method to perform baseline correction on Chromatorgam data,
 both Total Ion Chromatograms (TIC) and Extracted Ion Chromatograms (XIC)
 
-Two implemented methods, SNIP and AsLS
+Implemented methods, registered in BASELINE_METHODS and selected with the config
+key baseline.method: AsLS, arPLS, airPLS (penalized least squares with different
+reweighting) and SNIP. Every method takes a 2D array (chromatograms x scans) and
+returns (baselines, corrected) arrays of the same shape.
 
 Perform Asymmetric Least Squares (AsLS) baseline correction.
 
@@ -23,13 +26,71 @@ Perform Asymmetric Least Squares (AsLS) baseline correction.
 """
 import time
 import warnings
+from functools import lru_cache
 
 import numpy as np
-import pandas as pd
-from scipy import sparse
-from scipy.sparse.linalg import spsolve
-import tqdm
-from src.helpers import log_method_entry
+from scipy.linalg import solveh_banded
+
+
+@lru_cache(maxsize=32)
+def second_difference_banded(L: int) -> np.ndarray:
+    """
+    D^T D of the second order difference matrix D for a signal of length L, in the upper
+    banded form of scipy.linalg.solveh_banded: row 2 is the main diagonal, rows 1 and 0
+    the first and second super diagonals (right aligned). Cached per length, read only.
+    """
+    ab = np.zeros((3, L))
+    if L >= 3:
+        # diagonal [1, 5, 6, ..., 6, 5, 1], first off diagonal [-2, -4, ..., -4, -2], second all 1
+        ab[2] = 6.0
+        ab[2, [0, -1]] = 1.0
+        ab[2, [1, -2]] = 5.0 if L > 3 else 4.0
+        ab[1, 1:] = -4.0
+        ab[1, [1, -1]] = -2.0
+        ab[0, 2:] = 1.0
+    ab.flags.writeable = False
+    return ab
+
+
+def reweighted_whittaker(Y: np.ndarray, lam: float, niter: int, update) -> np.ndarray:
+    """
+    Iteratively reweighted Whittaker smoothing shared by AsLS, arPLS and airPLS: solves
+    (W + lam * D^T D) z = W y for all active rows at once as one block diagonal banded
+    system (the cached D^T D band tiled per row; it starts with zeros, so the blocks do
+    not couple). update(i, y, z, z_prev, w) returns the next weights and a per-row
+    convergence mask; converged rows drop out of the system, as do rows whose next
+    weights would make the system singular.
+    """
+    n_rows, L = Y.shape  # number of chromatograms, points per signal
+    lam_DTD = lam * second_difference_banded(L)
+    W = np.ones((n_rows, L))
+    Z = Y.copy()
+    active = np.arange(n_rows)
+
+    for i in range(niter):
+        if not len(active):
+            break
+        y, w = Y[active], W[active]
+
+        ab = np.tile(lam_DTD, (1, len(active)))
+        ab[2] += w.ravel()
+        z = solveh_banded(ab, (w * y).ravel(), check_finite=False).reshape(len(active), L)
+
+        w_new, converged = update(i, y, z, Z[active], w)
+        # fewer than 2 weighted points leave W + lam * DTD singular (e.g. an all zero trace): keep z
+        converged |= np.count_nonzero(w_new, axis=1) < 2
+        Z[active], W[active] = z, w_new
+        active = active[~converged]
+
+    return Z
+
+
+def clipped_residual(Y: np.ndarray, Z: np.ndarray) -> np.ndarray:
+    """y - baseline clipped at 0, and 0 where the signal itself is 0."""
+    corrected = np.maximum(Y - Z, 0)
+    corrected[Y == 0] = 0  # Do not invent signal where none existed
+    return corrected
+
 
 class BaselineCorrection:
     def __init__(self,**kwargs):
@@ -55,13 +116,14 @@ class BaselineCorrection:
         y : array-like
             1D input array of intensities (spectrum or chromatogram).
         lam : float
-            Smoothness parameter (lambda). Larger = smoother baseline. 1e4-1e6?
+            Smoothness parameter (lambda, config key 'lam' or 'lambda'). Larger = smoother baseline. 1e4-1e6?
         p : float
             Asymmetry parameter (0 < p < 1). Smaller = baseline forced under peaks.
         niter : int
             Maximum number of iterations.
         tol : float
-            Convergence tolerance (relative change in baseline).
+            Convergence tolerance: stops once the weights no longer change or the
+            baseline changes by less than tol relative to its norm.
 
         Returns
         -------
@@ -70,140 +132,198 @@ class BaselineCorrection:
         corrected : ndarray
             Baseline-corrected signal (y - baseline, clipped at 0).
         """
-        lam = float(kwargs.get('lam', 1e6))
-        p = float(kwargs.get('p', 0.1))
-        niter = int(kwargs.get('niter', 10))
-        tol = float(kwargs.get('tol', 1e-6))
-
         #Check for numpy array type
-        if not isinstance(y, np.ndarray):
-            y = np.asarray(y)
+        y = np.asarray(y, dtype=np.float64)
 
-        L = len(y)  # number of points in signal
-        w = np.ones(L)
-        D = sparse.diags([1,-2,1],[0,-1,-2], shape=(L,L-2),format='csr')
-        DTD = D @ D.T
+        baseline, corrected = self.asls_batch(y[None, :], **kwargs)
+        return baseline[0], corrected[0]
 
-        for i in range(niter):
-            W = sparse.spdiags(w,0,L,L)
-            Z = W + lam * DTD
-            z = spsolve(Z,W @ y)
-            w = p * (y > z) + (1-p) * (y < z)
+    def asls_batch(self, Y, **kwargs):
+        """
+        AsLS baseline of every row of a 2D array (chromatograms x scans) of equal length
+        signals, with the same parameters as asls. All rows are solved together, see
+        reweighted_whittaker.
+
+        Returns
+        -------
+        baselines, corrected : ndarray
+            Arrays of the same shape as Y.
+        """
+        lam = float(kwargs.get('lam', kwargs.get('lambda', 1e6)))
+        p = float(kwargs.get('p', 0.1))
+        niter = int(kwargs.get('niter', 10))
+        tol = float(kwargs.get('tol', 1e-6))
 
+        def update(i, y, z, z_prev, w):
+            converged = np.zeros(len(y), dtype=bool) if i == 0 else \
+                np.linalg.norm(z - z_prev, axis=1) <= tol * np.linalg.norm(z_prev, axis=1)
+            w_new = p * (y > z) + (1-p) * (y < z)
+            return w_new, converged | (w_new == w).all(axis=1)
 
+        Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+        Z = reweighted_whittaker(Y, lam, niter, update)
+        return Z, clipped_residual(Y, Z)
 
+    def arpls_batch(self, Y, **kwargs):
+        """
+        Asymmetrically reweighted penalized least squares (S.-J. Baek et al., Analyst 2015)
+        of every row of a 2D array. Points above the baseline get a logistic weight from
+        the mean and std of the negative residuals, so noise is not treated as peak.
 
-        # Construct second-order difference matrix (D), this enforces "smoothness" of the baseline.
-        # D = sparse.diags([1, -2, 1], [0, 1, 2], shape=(L - 2, L))
+        Parameters: lam (or lambda), niter, and tol, the relative weight change to stop at.
+        """
+        lam = float(kwargs.get('lam', kwargs.get('lambda', 1e5)))
+        niter = int(kwargs.get('niter', 50))
+        tol = float(kwargs.get('tol', 1e-6))
 
-        # DTD = D.T @ D  # Precompute D^T D (penalty term)
-        #
-        # # Initialize weights (all ones at start, size of y numpy array)
-        # weights = np.ones(L)
-        # baseline_asls = np.zeros(L)
-        #
-        #
-        # # Iterative fitting
-        # for i in range(niter):
-        #     # Build diagonal weight matrix
-        #
-        #     W = sparse.diags(weights, 0,shape=(L,L), format="csr")
-        #
-        #     A = (W + lam * DTD).tocsr()
-        #     B = W @ y
-        #
-        #     # Solve linear system for baseline
-        #     b = spsolve(A, B)
+        def update(i, y, z, z_prev, w):
+            d = y - z
+            negative = d < 0
+            n_negative = negative.sum(axis=1)
+            mean = np.where(negative, d, 0).sum(axis=1) / np.maximum(n_negative, 1)
+            std = np.sqrt(np.where(negative, (d - mean[:, None]) ** 2, 0).sum(axis=1) / np.maximum(n_negative, 1))
 
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                w_new = 1 / (1 + np.exp(2 * (d - (2 * std - mean)[:, None]) / std[:, None]))
+            # rows without spread below the baseline have nothing left to reweight
+            degenerate = (std == 0) | ~np.isfinite(w_new).all(axis=1)
+            w_new[degenerate] = w[degenerate]
 
-        corrected_asls = y - z
-        corrected_asls = np.maximum(corrected_asls, 0)
-        corrected_asls[y == 0] = 0  # Do not invent signal where none existed
+            converged = degenerate | (np.linalg.norm(w - w_new, axis=1) <= tol * np.linalg.norm(w, axis=1))
+            return w_new, converged
 
-        return z, corrected_asls
+        Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+        Z = reweighted_whittaker(Y, lam, niter, update)
+        return Z, clipped_residual(Y, Z)
 
-    def snip(self,raw_df, **kwargs):
-        # for k,v in kwargs.items():
-            # print(k,v)
+    def airpls_batch(self, Y, **kwargs):
+        """
+        Adaptive iteratively reweighted penalized least squares (Z.-M. Zhang et al.,
+        Analyst 2010) of every row of a 2D array. Points above the baseline get weight 0,
+        points below it exp(i * |d| / |sum of negative residuals|); a row stops once its
+        negative residuals sum to less than tol * sum(|y|).
 
+        Parameters: lam (or lambda), niter, tol (default 1e-3 as in the paper).
+        """
+        lam = float(kwargs.get('lam', kwargs.get('lambda', 1e2)))
+        niter = int(kwargs.get('niter', 15))
+        tol = float(kwargs.get('tol', 1e-3))
+
+        def update(i, y, z, z_prev, w):
+            d = y - z
+            negative = d < 0
+            dssn = np.abs(np.where(negative, d, 0).sum(axis=1))
+            converged = dssn < tol * np.abs(y).sum(axis=1)
+
+            scale = (i + 1) / np.where(dssn > 0, dssn, 1)[:, None]
+            # capped below the float64 overflow of exp
+            w_new = np.where(negative, np.exp(np.minimum(scale * np.abs(d), 700)), 0.0)
+            end_weight = np.exp(np.minimum(scale[:, 0] * np.where(negative, np.abs(d), 0).max(axis=1), 700))
+            w_new[:, 0] = w_new[:, -1] = end_weight
+            return w_new, converged
+
+        Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+        Z = reweighted_whittaker(Y, lam, niter, update)
+        return Z, clipped_residual(Y, Z)
+
+    def snip_batch(self, Y, retention_time=None, **kwargs):
+        """
+        SNIP (statistics-sensitive non-linear iterative peak clipping) baseline of every row
+        of a 2D array, on the LLS transformed signal. window is the approximate peak width in
+        retention time units, or in points when retention_time is not given.
+        """
         window = kwargs.get('window', 5)
         precision = kwargs.get('precision', 9)
         clip_negatives = kwargs.get('clip_negatives', True)
 
-        # # Arrays
-        # retention_time_arr = rt_arr
-        # intensity_arr = i_arr
-        # Arrays
-        retention_time_arr = raw_df['retention_time']
-        intensity_arr = raw_df['intensity']
-
-        _timestep = float(np.mean(np.diff(retention_time_arr)))
-        # _timestep_precision = int(np.abs(np.ceil(np.log10(_timestep))))
+        Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+        L = Y.shape[1]
+
+        if retention_time is not None:
+            retention_time = np.asarray(retention_time, dtype=np.float64)
+            _timestep = float(np.mean(np.diff(retention_time)))
+            if (window / _timestep) < 10:
+                raise ValueError(
+                    f"The approximate peak width {window} is too small relative to the time sampling interval ({_timestep})."
+                    f"Either increase the width or set correct_baseline=False to skip this step."
+                )
+
+            # Sampling step
+            retention_timestep = float(np.median(np.diff(retention_time)))
+            if retention_timestep <= 0:
+                raise ValueError("retention_time must be strictly increasing")
+        else:
+            retention_timestep = 1.0
 
+        #Minimum required points within window
+        min_points = int(((window / retention_timestep) - 1) // 2)
+        if min_points < 1:
+            raise ValueError("Window too small for SNIP iterations")
 
-        if (window / _timestep) < 10:
-            raise ValueError(
-                f"The approximate peak width {window} is too small relative to the time sampling interval ({_timestep})."
-                f"Either increase the width or set correct_baseline=False to skip this step."
-            )
-
-        min_val, max_val = np.min(intensity_arr), np.max(intensity_arr)
+        min_val, max_val = Y.min(axis=1), Y.max(axis=1)
 
         #Warn for significant negative values.
-        if min_val < 0 and (min_val.abs() / max_val.abs()) >= 0.1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            significant = (min_val < 0) & (np.abs(min_val) / np.abs(max_val) >= 0.1)
+        if significant.any():
             warnings.warn(
                 "The chromatogram has significant negative values. Check results visually to determine if"
                 "baseline correction was applied correctly."
             )
 
-
-        # Sampling step
-        retention_timestep = float(np.median(np.diff(retention_time_arr)))
-
-        if retention_timestep <= 0:
-            raise ValueError("retention_time must be strictly increasing")
-
-        #Minimum required points within window
-        min_points = int(((window / retention_timestep) - 1) // 2)
-        if min_points < 1:
-            raise ValueError("Window too small for SNIP iterations")
-
         #Shift to avoid log of negative numbers, shift is returned after correction
-
-        shift = np.abs(np.min(intensity_arr)) + 1 if np.min(intensity_arr) < 0 else 0
-        y_shifted = intensity_arr + shift
+        shift = np.where(min_val < 0, np.abs(min_val) + 1, 0)[:, None]
 
         # Apply LLS transformation
-        # lls_transform = np.log(y_shifted + 1)
-
-        lls_transform = np.log(np.log(np.sqrt(y_shifted + 1) + 1) + 1)
-        n_iter = min(min_points,25)
-        iterator = tqdm.tqdm(range(n_iter),
-                             desc="\tPerforming SNIP baseline correction",
-                             ncols=100,
-                             leave=True
-                             )
-        for i in iterator:
-            time.sleep(0.01)
-            left = np.roll(lls_transform, i)
-            right = np.roll(lls_transform, -i)
-            avg = (left + right) * 0.5
-
-            avg[:i] = lls_transform[:i]
-            avg[-i:] = lls_transform[-i:]
-            lls_transform = np.minimum(lls_transform, avg)
-
-        iterator.set_description(f"\tFinished SNIP baseline correction")
-        time.sleep(0.01)
+        lls_transform = np.log(np.log(np.sqrt(Y + shift + 1) + 1) + 1)
+
+        # clip every point to the mean of its neighbours i points away, i = 1 .. n_iter - 1, on all rows at once
+        n_iter = min(min_points, 25, (L + 1) // 2)
+        for i in range(1, n_iter):
+            inner = lls_transform[:, i:L - i]
+            np.minimum(inner, (lls_transform[:, :L - 2 * i] + lls_transform[:, 2 * i:]) * 0.5, out=inner)
+
         # Inverse baseline
         baseline_snip = (np.exp(np.exp(lls_transform) - 1) - 1) ** 2 - 1
-
         baseline_snip = np.round(baseline_snip - shift, decimals=precision)
 
         #Corrected baseline signal
-        corrected_snip = intensity_arr - baseline_snip
+        corrected_snip = Y - baseline_snip
         if clip_negatives:
             corrected_snip = np.maximum(corrected_snip, 0)
 
-        return baseline_snip,corrected_snip
+        return baseline_snip, corrected_snip
+
+    def snip(self, raw_df, **kwargs):
+        """SNIP baseline of one (retention_time, intensity) chromatogram frame, see snip_batch."""
+        baseline, corrected = self.snip_batch(raw_df['intensity'].to_numpy(dtype=np.float64)[None, :],
+                                              retention_time=raw_df['retention_time'].to_numpy(), **kwargs)
+        return baseline[0], corrected[0]
 
+    def correct(self, method: str, Y, **kwargs):
+        """
+        Baseline of every row of Y with the registered method (see BASELINE_METHODS).
+        retention_time, when given, is used by methods that take their window in time units.
+        """
+        if method not in BASELINE_METHODS:
+            raise ValueError(f"Unknown baseline method: {method}, known: {list(BASELINE_METHODS)}")
+        return BASELINE_METHODS[method](self, Y, **kwargs)
+
+
+def correct_baseline_task(method: str, Y: np.ndarray, retention_time: np.ndarray | None = None, **kwargs):
+    """
+    Thread/process pool entry point: baselines of one batch of chromatograms with the
+    registered method. Returns (baselines, corrected, seconds spent in the method).
+    """
+    start = time.perf_counter()
+    baselines, corrected = BaselineCorrection().correct(method, Y, retention_time=retention_time, **kwargs)
+    return baselines, corrected, time.perf_counter() - start
+
+
+# baseline.method -> array-in/array-out engine, (chromatograms x scans) -> (baselines, corrected)
+BASELINE_METHODS = {
+    "asls": BaselineCorrection.asls_batch,
+    "arpls": BaselineCorrection.arpls_batch,
+    "airpls": BaselineCorrection.airpls_batch,
+    "snip": BaselineCorrection.snip_batch,
+}
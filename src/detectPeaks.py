@@ -1,3 +1,5 @@
+from time import perf_counter
+
 from numpy.ma.core import reshape
 from tqdm import tqdm
 
@@ -62,21 +64,15 @@ class DetectPeaks:
         # print(widths,l_ips, r_ips, sep='\n')
         # print(left_ips, right_ips, sep='\n')
 
-        # 4. Build peak ranges
-        peak_ranges = build_peak_ranges(left_ips,right_ips) # remember to refactor the #comment lines (remove them if this works)
-        # print(f"\t 4. peak ranges (index locations)")
-        # print(peak_ranges)
-
-
-        # 5. Remove subset ranges
+        # 4./5. Peak ranges as (left, right) index intervals, without those contained in another
         # print(f"\t 5. Subset ranges")
-        peak_ranges = remove_subset_ranges(peak_ranges)
-        # print(peak_ranges)
+        range_left, range_right = remove_subset_ranges(left_ips, right_ips)
+        # print(range_left, range_right)
 
         # 6. Build window dataframe
         window_df = self.sample_data.copy()
 
-        built_window = build_window_df(window_df,peak_ranges)
+        built_window = build_window_df(window_df, range_left, range_right)
         # print(f"\t 6. built_window")
         # print(built_window)
 
@@ -126,6 +122,9 @@ class DetectPeaks:
         peak_props = {}
         self._param_bounds = []
         self._p0 = []
+        # per window: peaks, function evaluations and wall time of the fit
+        self.fit_stats = {}
+        jac = sum_skewnorms_jacobian if self.detect_peak_params.get("analytic_jacobian", True) else None
 
         for k, v in iterator:
             iterator.set_description(f"\t Deconvolving window {k}/{len(iterator)} with {v['num_peaks']}peaks ")
@@ -170,14 +169,17 @@ class DetectPeaks:
                 self._p0.append(p0)
                 self._param_bounds.append((bounds_lower, bounds_upper))
 
-            #fit curves
-
-            popt, _ = scipy.optimize.curve_fit(sum_skewnorms,
-                                               v['time_range'],
-                                               v['signal'],
-                                               p0=p0,
-                                               bounds=(bounds_lower, bounds_upper),
-                                               maxfev=max_niter)
+            #fit curves, all peaks of the window in one broadcast model with its analytic Jacobian
+            start = perf_counter()
+            popt, _, infodict, _, _ = scipy.optimize.curve_fit(sum_skewnorms,
+                                                               v['time_range'],
+                                                               v['signal'],
+                                                               p0=p0,
+                                                               bounds=(bounds_lower, bounds_upper),
+                                                               jac=jac,
+                                                               maxfev=max_niter,
+                                                               full_output=True)
+            self.fit_stats[k] = {"num_peaks": v['num_peaks'], "nfev": int(infodict["nfev"]), "seconds": perf_counter() - start}
 
             popt = reshape(popt, (v['num_peaks'], 4))
             for i, p in enumerate(popt):
@@ -197,6 +199,9 @@ class DetectPeaks:
 
             iterator.set_description("\t Finished deconvolution")
 
+        for k, stats in self.fit_stats.items():
+            print(f"\t  window {k}: {stats['num_peaks']} peaks, nfev={stats['nfev']}, {stats['seconds']:.3f} s")
+
         rows = [
             {
                 "retention_time": p["retention_time"],
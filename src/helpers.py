@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import scipy.signal
+import scipy.special
 import warnings
 import sys
 from colorama import Fore, Style, init
@@ -22,59 +23,79 @@ def calculate_peak_widths(intensity: np.ndarray, peak_indices: np.ndarray, rel_h
         widths, _, left_ips, right_ips = scipy.signal.peak_widths(intensity, peak_indices, rel_height=rel_height)
     return widths, left_ips.astype(int), right_ips.astype(int)
 
-def build_peak_ranges(_left, _right,
-                      # norm_int_len: int,
-                      # buffer: int
-                      ) -> list[np.ndarray]:
-    # ranges = []
-    # for l, r in zip(_left, _right):
-    #     rnge = np.arange(int(l), int(r + 1))
-    #     # rnge = rnge[(rnge >= 0) & (rnge < norm_int_len)]
-    #     ranges.append(rnge)
-
-    return [np.arange(l, r + 1) for l, r in zip(_left, _right)]
-
-def remove_subset_ranges(ranges: list[np.ndarray]) -> list[np.ndarray]:
-    valid = [True] * len(ranges)
-    for i, r1 in enumerate(ranges):
-        for j, r2 in enumerate(ranges):
-            if i != j and set(r2).issubset(r1):
-                valid[j] = False
-    return [r for i, r in enumerate(ranges) if valid[i]]
-
-def build_window_df(df: pd.DataFrame, ranges: list[np.ndarray]) -> pd.DataFrame:
+def remove_subset_ranges(left: np.ndarray, right: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Drops every [left, right] index range contained in another one (identical ranges
+    contain each other, so all copies go), keeping the rest in their original order.
+    One sweep over the ranges sorted by left ascending, right descending: a range is
+    contained in an earlier one when an earlier range reaches at least as far right.
+    """
+    left, right = np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64)
+    if len(left) == 0:
+        return left, right
+
+    order = np.lexsort((-right, left))
+    sorted_left, sorted_right = left[order], right[order]
+
+    reach = np.maximum.accumulate(sorted_right)
+    contained = np.zeros(len(order), dtype=bool)
+    contained[1:] = reach[:-1] >= sorted_right[1:]
+    duplicate = (sorted_left[1:] == sorted_left[:-1]) & (sorted_right[1:] == sorted_right[:-1])
+    contained[:-1] |= duplicate
+
+    keep = np.ones(len(order), dtype=bool)
+    keep[order[contained]] = False
+    return left[keep], right[keep]
+
+def build_window_df(df: pd.DataFrame, left: np.ndarray, right: np.ndarray) -> pd.DataFrame:
+    """
+    Labels every row with the window of the peak range covering it, window i + 1 for range
+    i; where ranges overlap the later one wins, as if they were assigned in order. The
+    ranges must be free of contained ones (remove_subset_ranges), so sorted by left they
+    are sorted by right as well and the ranges covering a row are a contiguous run of them.
+    """
     df = df.copy()
-    df["time_idx"] = np.arange(len(df))
+    time_idx = np.arange(len(df))
+    df["time_idx"] = time_idx
     df["window_id"] = 0
     df["window_type"] = "peak"
 
-    for i, r in enumerate(ranges):
-        df.loc[df["time_idx"].isin(r), "window_id"] = i + 1
+    if len(left):
+        order = np.argsort(left, kind="stable")
+        labels = np.append(order + 1, 0)
+
+        # ranges [first, last) in sorted order cover each row; take the highest label of the run
+        first = np.searchsorted(right[order], time_idx, side="left")
+        last = np.searchsorted(left[order], time_idx, side="right")
+        window_id = np.maximum.reduceat(labels, np.column_stack([first, last]).ravel())[::2]
+        df["window_id"] = np.where(last > first, window_id, 0)
 
     return df
 
 def assign_background_windows(window_df: pd.DataFrame) -> pd.DataFrame:
-    bg = window_df[window_df["window_id"] == 0]
-    tidx = bg["time_idx"].values
+    """
+    Turns the unlabelled rows between peak windows into 'interpeak' windows: a single
+    background segment becomes window 1 whatever its length; with several segments,
+    segment i gets window i + 1 if it spans at least 10 rows, and shorter ones are dropped.
+    """
+    window_id = window_df["window_id"].to_numpy().copy()
+    bg = np.flatnonzero(window_id == 0)
+    tidx = window_df["time_idx"].to_numpy()[bg]
 
     if not len(bg):
         return window_df
 
-    diff = np.diff(tidx)
-    split_inds = np.where(diff > 1)[0]
-    # print(split_inds)
-    if len(split_inds) == 0:
-        window_df.loc[bg.index, ["window_id", "window_type"]] = [1, "interpeak"]
+    # 1-based segment number of every background row, a new segment after each gap
+    segment = np.cumsum(np.r_[True, np.diff(tidx) > 1])
+    if segment[-1] == 1:
+        window_df.loc[window_df.index[bg], ["window_id", "window_type"]] = [1, "interpeak"]
         return window_df
 
-    split_inds = np.insert(split_inds + 1, 0, 0)
-    split_inds = np.append(split_inds, len(tidx))
-
-    for i, (start, end) in enumerate(zip(split_inds[:-1], split_inds[1:])):
-        segment = tidx[start:end]
-        if len(segment) >= 10:
-            window_df.loc[window_df["time_idx"].isin(segment), "window_id"] = i + 1
-            window_df.loc[window_df["time_idx"].isin(segment), "window_type"] = "interpeak"
+    long_enough = np.bincount(segment)[segment] >= 10
+    window_id[bg[long_enough]] = segment[long_enough]
+    window_type = window_df["window_type"].to_numpy().copy()
+    window_type[bg[long_enough]] = "interpeak"
+    window_df["window_id"], window_df["window_type"] = window_id, window_type
 
     return window_df[window_df["window_id"] > 0]
 
@@ -85,18 +106,57 @@ def extract_window_props(window_df: pd.DataFrame,
                          timestep_precision,
                          timestep,
                          widths) -> dict:
+    """
+    Properties of every 'peak' window, by window id: its time range, signal and signal area,
+    and the amplitude, location and width of the detected peaks inside it (in peak_indice
+    order). The window rows are sorted by (window id, time) once; windows are slices of
+    that order, areas one np.add.reduceat, and peaks are located with np.searchsorted.
+    """
+    peak_rows = window_df[window_df["window_type"] == "peak"]
+    window_id = peak_rows["window_id"].to_numpy(dtype=np.int64)
+    time_idx = peak_rows["time_idx"].to_numpy(dtype=np.int64)
+    if not len(window_id):
+        return {}
+
+    n_idx = int(time_idx.max()) + 1
+    order = np.lexsort((time_idx, window_id))
+    keys = window_id[order] * n_idx + time_idx[order]
+    time_values = peak_rows[time_col].to_numpy()[order]
+    signal_values = peak_rows[signal_col].to_numpy()[order]
+
+    starts = np.flatnonzero(np.r_[True, window_id[order][1:] != window_id[order][:-1]])
+    ends = np.append(starts[1:], len(order))
+    window_ids = window_id[order][starts]
+    areas = np.add.reduceat(signal_values, starts)
+
+    # window of every detected peak (0 outside peak windows), then its row in the sorted order
+    peak_indice = np.asarray(peak_indice, dtype=np.int64)
+    labels = np.zeros(n_idx, dtype=np.int64)
+    labels[time_idx] = window_id
+    inside = peak_indice < n_idx
+    peak_window = np.zeros(len(peak_indice), dtype=np.int64)
+    peak_window[inside] = labels[peak_indice[inside]]
+
+    in_window = np.flatnonzero(peak_window > 0)
+    in_window = in_window[np.argsort(peak_window[in_window], kind="stable")]
+    rows = np.searchsorted(keys, peak_window[in_window] * n_idx + peak_indice[in_window])
+    peak_bounds = np.searchsorted(peak_window[in_window], window_ids, side="left"), \
+        np.searchsorted(peak_window[in_window], window_ids, side="right")
+
+    amplitude = signal_values[rows]
+    location = np.round(time_values[rows], timestep_precision)
+    width = np.asarray(widths)[in_window] * timestep
+
     window_dict = {}
-    for gid, group in window_df[window_df["window_type"] == "peak"].groupby("window_id"):
-        peak_idxs = [i for i in peak_indice if i in group["time_idx"].values]
-        peak_inds = [np.where(peak_indice == i)[0][0] for i in peak_idxs]
+    for gid, start, end, area, peak_start, peak_end in zip(window_ids.tolist(), starts, ends, areas, *peak_bounds):
         window_dict[gid] = {
-            "time_range": group[time_col].values,
-            "signal": group[signal_col].values,
-            "signal_area": group[signal_col].sum(),
-            "num_peaks": len(peak_idxs),
-            "amplitude": [group[group["time_idx"] == p][signal_col].iloc[0] for p in peak_idxs],
-            "location": [np.round(group[group["time_idx"] == p][time_col].iloc[0], timestep_precision) for p in peak_idxs],
-            "width": [widths[i] * timestep for i in peak_inds],
+            "time_range": time_values[start:end],
+            "signal": signal_values[start:end],
+            "signal_area": area,
+            "num_peaks": int(peak_end - peak_start),
+            "amplitude": list(amplitude[peak_start:peak_end]),
+            "location": list(location[peak_start:peak_end]),
+            "width": list(width[peak_start:peak_end]),
         }
     return window_dict
 
@@ -115,21 +175,45 @@ def default_param_bounds(amplitude,time_min, time_max):
         "skew": [-np.inf, np.inf],
     }
 
+def skewnorm_terms(x, params):
+    """
+    Shared pieces of the skew-normal peaks f = a * (2 / s) * phi(z) * Phi(alpha * z), z = (x - loc) / s,
+    for all peaks at once: params (amplitude, loc, scale, skew per peak) become (n_peaks, 1)
+    columns broadcast against x. Returns (a, s, alpha, z, 2 * phi(z) / s, Phi(alpha * z)).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    a, loc, scale, alpha = np.asarray(params, dtype=np.float64).reshape(-1, 4).T[:, :, None]
+    z = (x - loc) / scale
+    density = 2 * np.exp(-0.5 * z ** 2) / (np.sqrt(2 * np.pi) * scale)
+    return a, scale, alpha, z, density, scipy.special.ndtr(alpha * z)
+
 def sum_skewnorms(x, *params):
     """
     Sum of skew-normal distributions for curve fitting.
     Each peak is represented by 4 parameters: amplitude, center, width, skew.
+    All peaks are evaluated in one broadcast expression (the same curve as compute_skewnorm).
+    """
+    a, scale, alpha, z, density, cdf = skewnorm_terms(x, params)
+    return (a * density * cdf).sum(axis=0)
+
+def sum_skewnorms_jacobian(x, *params):
+    """
+    Analytic Jacobian of sum_skewnorms, (len(x), 4 * n_peaks) with the columns in params order:
+        df/da     = (2 / s) phi(z) Phi(alpha z)
+        df/dz     = a (2 / s) phi(z) [alpha phi(alpha z) - z Phi(alpha z)]
+        df/dloc   = -(df/dz) / s
+        df/dscale = -f / s - (df/dz) z / s
+        df/dalpha = a (2 / s) phi(z) phi(alpha z) z
     """
-    from scipy.stats import skewnorm
-    n_params_per_peak = 4
-    n_peaks = len(params) // n_params_per_peak
-    y = np.zeros_like(x)
+    a, scale, alpha, z, density, cdf = skewnorm_terms(x, params)
+    skew_density = np.exp(-0.5 * (alpha * z) ** 2) / np.sqrt(2 * np.pi)
 
-    for i in range(n_peaks):
-        a, loc, scale, skew = params[i * 4:(i + 1) * 4]
-        y += skewnorm.pdf(x, skew, loc, scale) * a
+    df_da = density * cdf
+    f = a * df_da
+    df_dz = a * density * (alpha * skew_density - z * cdf)
 
-    return y
+    jacobian = np.stack([df_da, -df_dz / scale, -(f + df_dz * z) / scale, a * density * skew_density * z], axis=1)
+    return jacobian.reshape(-1, jacobian.shape[-1]).T
 
 def compute_skewnorm(x, amplitude, loc, scale, alpha):
     _x = alpha * (x - loc) / scale
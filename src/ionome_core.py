@@ -1,12 +1,16 @@
 # load Ionome classes
 import time
 
+import numpy as np
 import pandas as pd
 
-from src.sampleData import SampleData
-from src.preprocess import MzmlParser
-from src.correct_baseline import BaselineCorrection
-from src.PeakDetection import PeakDetection
+from src.sampleData import SampleData, extract_sample_xic
+from src.compound_library import CompoundLibrary
+from src.xic_matrix import target_windows
+from src.preprocess import MzmlParser, accumulate_mzml_file, cache_mzml_file, load_cached_sample, read_scans
+from src.spectrum_store import SpectrumStore, store_path
+from src.correct_baseline import correct_baseline_task
+from src.baseline_cache import BaselineCache
 from src.Visualization import Chromatograms
 from src.paths import output_path
 from time import sleep
@@ -14,6 +18,9 @@ from src.helpers import log_method_entry
 from src.detectPeaks import DetectPeaks
 
 # libraries
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
 import yaml
 import pickle
@@ -44,6 +51,9 @@ class Ionome:
         self.rerun: bool = self.config.get("rerun", False)
         self._method = self.config["baseline"].get("method", "asls")
 
+        # compound library expanded into adduct/isotope targets, used next to target_mz_list
+        self.library = self._load_library(self.config.get("library", {}))
+
         # sample yaml metadata
         self.sample_metadata = self._load_sample_yaml(samples)
 
@@ -76,71 +86,385 @@ class Ionome:
             meta_by_unique_id[unique_id] = sample
         return meta_by_unique_id
 
-    def load_data(self, **kwargs):
+    def _load_library(self, library_cfg: dict) -> CompoundLibrary | None:
+        if not library_cfg.get("path"):
+            return None
+
+        extract_xic_cfg = self.config.get("target_mz_params", {})
+        tolerance_type = extract_xic_cfg.get("tolerance_type", "ppm")
+        library = CompoundLibrary.load(self.project_path / library_cfg["path"],
+                                       adducts=library_cfg.get("adducts", ["[M-H]-"]),
+                                       isotopes=library_cfg.get("isotopes", 0),
+                                       tol=self._xic_tolerance(tolerance_type),
+                                       tol_type=tolerance_type,
+                                       cache_dir=output_path(self.run_id, "cached_dir"))
+        print(f"\t> Compound library {library_cfg['path']}: {library}")
+        return library
+
+    def xic_targets(self, tolerance_type: str) -> tuple[dict[str, float], tuple | None]:
+        """
+        target_mz_list plus the compound library targets, and their (lower, upper) windows
+        when the library's precomputed ones apply (None means derive them from the tolerance).
+        """
+        if self.library is None:
+            return self.target_mz_list, None
+
+        target_list = {**self.target_mz_list, **self.library.target_list}
+        if tolerance_type != self.config.get("target_mz_params", {}).get("tolerance_type", "ppm") or \
+                len(target_list) != len(self.target_mz_list) + len(self.library):
+            return target_list, None
+
+        lower, upper = target_windows(self.target_mz_list, self._xic_tolerance(tolerance_type), tolerance_type)
+        return target_list, (np.concatenate([lower, self.library.lower]), np.concatenate([upper, self.library.upper]))
+
+    def load_data(self, **kwargs) -> dict[str, Exception]:
         """Loads the mzML file, will parse mzML file if parquet file is not already cached,
-        Will save cached parquet file upon first parse of mzML file"""
+        Will save cached parquet file upon first parse of mzML file.
+        With parser.compact, raw only keeps (scan_idx, mz, intensity) and the scan level
+        columns live in SampleData.scans. With parser.cache_backend 'npy', raw stays None and
+        SampleData.store memory-maps the spectra instead. With parser.keep_raw false, the
+        quality control and target XICs are computed while reading and raw is never built.
+        A sample that fails to load is reported and skipped; returns {uid: exception} of them"""
         log_method_entry()
 
         parser_cfg = self.config.get("parser", {})
+        workers = int(parser_cfg.get("workers", 1))
 
         print(f"\t> Loading spectra data:")
 
-        for uid, sampleData in self.samples.items():
+        if not parser_cfg.get("keep_raw", True):
+            return self._stream_data(parser_cfg, workers)
+
+        if workers > 1:
+            return self._load_data_parallel(parser_cfg, workers, **kwargs)
+
+        failed = {}
+        for n, (uid, sampleData) in enumerate(self.samples.items(), start=1):
             mzml_path = self.raw_data / sampleData.file
-            parser = MzmlParser(mzml_path,run_id=self.run_id, rerun=self.rerun, **parser_cfg)
+            try:
+                parser = MzmlParser(mzml_path,run_id=self.run_id, rerun=self.rerun, **parser_cfg)
+
+                if parser_cfg.get("cache_backend", "parquet") == "npy":
+                    sampleData.store = parser.parse_or_load_store(**kwargs)
+                    sampleData.scans = sampleData.store.scans
+                elif parser_cfg.get("compact", False):
+                    sampleData.raw, sampleData.scans = parser.parse_or_load_compact(**kwargs)
+                else:
+                    sampleData.raw = parser.parse_or_load_mzml(**kwargs)
+                    sampleData.scans = read_scans(parser.cache_path)
+                sampleData.cache_path = parser.cache_path
+            except Exception as e:
+                failed[uid] = e
+                print(f"\t \033[31m x \033[0m[{n}/{len(self.samples)}] {sampleData.file}: {type(e).__name__}: {e}")
+                continue
+            print(f"\t \033[32m ✓ \033[0m[{n}/{len(self.samples)}] {sampleData.file}")
+
+        if failed:
+            print(f"\t> {len(failed)} of {len(self.samples)} samples failed to load: {', '.join(failed)}")
+
+        return failed
+
+    def _load_data_parallel(self, parser_cfg: dict, workers: int, **kwargs) -> dict[str, Exception]:
+        """
+        Parses and caches the mzML files in a process pool, then loads each parquet cache
+        into the matching SampleData.raw. A sample that fails to parse is reported and
+        left with raw=None, the remaining samples still load.
+        """
+        failed = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(cache_mzml_file, self.raw_data / sampleData.file, self.run_id, self.rerun, parser_cfg, **kwargs): uid
+                for uid, sampleData in self.samples.items()
+            }
+
+            for n, future in enumerate(as_completed(futures), start=1):
+                sampleData = self.samples[futures[future]]
+                try:
+                    sampleData.cache_path = future.result()
+                    if parser_cfg.get("cache_backend", "parquet") == "npy":
+                        sampleData.store = SpectrumStore(store_path(sampleData.cache_path))
+                        sampleData.scans = sampleData.store.scans
+                    else:
+                        sampleData.raw, sampleData.scans = load_cached_sample(sampleData.cache_path,
+                                                                              parser_cfg.get("compact", False),
+                                                                              parser_cfg.get("float32_intensity", True))
+                except Exception as e:
+                    failed[sampleData.unique_id] = e
+                    print(f"\t \033[31m x \033[0m[{n}/{len(futures)}] {sampleData.file}: {type(e).__name__}: {e}")
+                    continue
+                print(f"\t \033[32m ✓ \033[0m[{n}/{len(futures)}] {sampleData.file}")
+
+        if failed:
+            print(f"\t> {len(failed)} of {len(futures)} samples failed to load: {', '.join(failed)}")
+
+        return failed
+
+    def _xic_tolerance(self, tolerance_type: str) -> float:
+        # low resolution -> 'da'
+        # high resolution -> 'ppm'
+        extract_xic_cfg = self.config.get("target_mz_params", {})
+        if tolerance_type == "da":
+            return extract_xic_cfg["da"]
+        return extract_xic_cfg["ppm"]
+
+    def _stream_data(self, parser_cfg: dict, workers: int) -> dict[str, Exception]:
+        """
+        Reads every mzML file once and fills SampleData.quality_control and SampleData.xic
+        directly from the spectra, in a process pool when workers > 1. raw stays None and
+        nothing is cached. Samples that fail are reported and returned like _load_data_parallel.
+        """
+        extract_xic_cfg = self.config.get("target_mz_params", {})
+        tolerance_type = extract_xic_cfg.get("tolerance_type", "ppm")
+        args = (self.run_id, parser_cfg, self.xic_targets(tolerance_type)[0], self._xic_tolerance(tolerance_type), tolerance_type,
+                extract_xic_cfg.get("aggregation", "sum"))
+
+        failed = {}
+        with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as pool:
+            if pool is None:
+                # serial: results are computed lazily, one file at a time
+                results = ((uid, partial(accumulate_mzml_file, self.raw_data / sampleData.file, *args))
+                           for uid, sampleData in self.samples.items())
+            else:
+                futures = {pool.submit(accumulate_mzml_file, self.raw_data / sampleData.file, *args): uid
+                           for uid, sampleData in self.samples.items()}
+                results = ((futures[future], future.result) for future in as_completed(futures))
+
+            for n, (uid, result) in enumerate(results, start=1):
+                sampleData = self.samples[uid]
+                try:
+                    sampleData.quality_control, sampleData.xic = result()
+                except Exception as e:
+                    failed[uid] = e
+                    print(f"\t \033[31m x \033[0m[{n}/{len(self.samples)}] {sampleData.file}: {type(e).__name__}: {e}")
+                    continue
+                print(f"\t \033[32m ✓ \033[0m[{n}/{len(self.samples)}] {sampleData.file} (streamed QC + {len(sampleData.xic)} XIC)")
 
-            sampleData.raw = parser.parse_or_load_mzml(**kwargs)
+        if failed:
+            print(f"\t> {len(failed)} of {len(self.samples)} samples failed to load: {', '.join(failed)}")
+
+        return failed
 
     def extract_quality_control(self):
         log_method_entry()
 
         print(f"\t> Extracting quality control data (TIC,BPC):")
         for uid, sampleData in self.samples.items():
+            if not sampleData.has_spectra():
+                if sampleData.quality_control is not None:
+                    print(f"\t \033[32m ✓ \033[0m{uid} (computed while parsing)")
+                else:
+                    print(f"\t \033[31m x \033[0m{uid}: no spectra data loaded, skipping")
+                continue
 
             sampleData.qc_df()
 
-    def extract_ion_chromatograms(self, tolerance_type: str = "ppm"):
+    def extract_ion_chromatograms(self, tolerance_type: str = "ppm", from_cache: bool | None = None):
+        """
+        Extracts the XIC matrix of all target m/z values, reducing the peaks of a scan inside
+        a window with target_mz_params.aggregation ('sum' or 'max'). With from_cache=True
+        (default target_mz_params.from_cache) the m/z windows are read straight from each
+        sample's parquet cache, touching only the matching row groups.
+        With target_mz_params.workers > 1 the samples are extracted in a thread or process
+        pool (target_mz_params.executor). Failed samples are reported and returned.
+        """
         log_method_entry()
 
         extract_xic_cfg = self.config.get("target_mz_params", {})
+        if from_cache is None:
+            from_cache = extract_xic_cfg.get("from_cache", False)
+        workers = int(extract_xic_cfg.get("workers", 1))
 
-        # low resolution -> 'da'
-        # high resolution -> 'ppm'
-        if tolerance_type == "da":
-            tolerance = extract_xic_cfg["da"]
-        else:
-            tolerance = extract_xic_cfg["ppm"]
+        target_list, windows = self.xic_targets(tolerance_type)
+        xic_kwargs = dict(target_list=target_list, tol=self._xic_tolerance(tolerance_type), tol_type=tolerance_type,
+                          from_cache=from_cache, aggregation=extract_xic_cfg.get("aggregation", "sum"), windows=windows)
 
         print(f"\t> Extracting XIC chromatogram data:")
+        pending, failed = {}, {}
+        for uid, sampleData in self.samples.items():
+            # samples never loaded in this session can still be read from a valid cache of an earlier run
+            if from_cache and sampleData.cache_path is None:
+                parser = MzmlParser(self.raw_data / sampleData.file, run_id=self.run_id, rerun=False, **self.config.get("parser", {}))
+                if parser.cache_is_valid():
+                    sampleData.cache_path = parser.cache_path
+
+            if not (sampleData.cache_path is not None if from_cache else sampleData.has_spectra()):
+                if sampleData.xic:
+                    print(f"\t \033[32m ✓ \033[0m{uid} (computed while parsing)")
+                else:
+                    print(f"\t \033[31m x \033[0m{uid}: no spectra data loaded, skipping")
+                continue
+
+            if workers > 1:
+                pending[uid] = sampleData
+            else:
+                try:
+                    sampleData.xic_df(**xic_kwargs)
+                except Exception as e:
+                    failed[uid] = e
+                    print(f"\t \033[31m x \033[0m{uid}: {type(e).__name__}: {e}")
+
+        if pending:
+            return self._extract_ion_chromatograms_parallel(pending, workers, extract_xic_cfg.get("executor", "thread"), xic_kwargs)
+        if failed:
+            print(f"\t> {len(failed)} of {len(self.samples)} samples failed XIC extraction: {', '.join(failed)}")
+        return failed
+
+    def _extract_ion_chromatograms_parallel(self, samples: dict[str, SampleData], workers: int, executor: str,
+                                            xic_kwargs: dict) -> dict[str, Exception]:
+        """
+        Runs xic_df for every sample in a pool and writes each XIC matrix back to its SampleData.
+        Threads share the loaded samples; processes receive a SampleData.xic_payload copy,
+        only the cache path when reading from the parquet cache.
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+
+        failed = {}
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            futures = {
+                pool.submit(extract_sample_xic,
+                            sampleData if executor == "thread" else sampleData.xic_payload(xic_kwargs["from_cache"]),
+                            **xic_kwargs): uid
+                for uid, sampleData in samples.items()
+            }
+
+            for n, future in enumerate(as_completed(futures), start=1):
+                sampleData = samples[futures[future]]
+                try:
+                    sampleData.xic = future.result()
+                except Exception as e:
+                    failed[sampleData.unique_id] = e
+                    print(f"\t \033[31m x \033[0m[{n}/{len(futures)}] {sampleData.unique_id}: {type(e).__name__}: {e}")
+                    continue
+                print(f"\t \033[32m ✓ \033[0m[{n}/{len(futures)}] {sampleData.unique_id} ({len(sampleData.xic)} XIC)")
+
+        if failed:
+            print(f"\t> {len(failed)} of {len(futures)} samples failed XIC extraction: {', '.join(failed)}")
+
+        return failed
+
+    def detect_rois(self):
+        """
+        Untargeted ROI (mass trace) detection for every loaded sample with the 'roi' config.
+        The traces land in SampleData.roi_traces and go through correct_baseline("roi") and
+        DetectPeaks like the XICs.
+        """
+        log_method_entry()
+        roi_cfg = self.config.get("roi", {})
+
+        print(f"\t> Detecting regions of interest (ROI):")
         for uid, sampleData in self.samples.items():
+            if not sampleData.has_spectra():
+                print(f"\t \033[31m x \033[0m{uid}: no spectra data loaded, skipping")
+                continue
 
-            sampleData.xic_df(target_list=self.target_mz_list, tol=tolerance, tol_type=tolerance_type)
+            sampleData.detect_rois(**roi_cfg)
 
-    def correct_baseline(self, chromatogram: str):
+    def correct_baseline(self, chromatogram: str) -> dict[str, Exception]:
+        """
+        Corrects the baseline of every sample's chromatograms with baseline.method. Equal
+        length chromatograms of a sample are corrected together in batches of up to
+        baseline.batch_size rows, one task per (sample, batch), in a thread or process pool
+        when baseline.workers > 1. Results are written back with add_chromatograms in
+        sample and chromatogram order, whatever order the tasks finish in; the time of each
+        task is reported. With baseline.cache, chromatograms whose intensities, method and
+        parameters are unchanged are read from the baseline cache instead of solved.
+        Samples without these chromatograms (e.g. that failed to load) are skipped; they and
+        the samples whose correction fails are reported and returned.
+        """
         baseline_cfg = self.config.get("baseline", {})
-        correction_params = baseline_cfg.get(self._method)
+        correction_params = baseline_cfg.get(self._method) or {}
+        workers = int(baseline_cfg.get("workers", 1))
+        executor = baseline_cfg.get("executor", "thread")
+        batch_size = max(int(baseline_cfg.get("batch_size", 256)), 1)
         log_method_entry()
 
-        bc = BaselineCorrection()
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+
+        cache = None
+        if baseline_cfg.get("cache", False):
+            cache = BaselineCache(output_path(self.run_id, "cached_dir") / "baseline", max_mb=baseline_cfg.get("cache_max_mb", 512))
+
+        col_name = "intensity" if chromatogram in ("xic", "roi") else chromatogram
         print(f"\t> Correcting {chromatogram} chromatogram baseline using '{self._method}' method:")
+
+        # (uid, chromatogram names, frames) per task; chromatograms of one sample share the scan axis
+        frames, keys, corrections, tasks, failed = {}, {}, {}, [], {}
         for uid, sampleData in self.samples.items():
+            if not sampleData.has_chromatograms(chromatogram):
+                failed[uid] = ValueError(f"no {chromatogram} chromatograms")
+                print(f"\t \033[31m x \033[0m{uid}: no {chromatogram} chromatograms, skipping")
+                continue
+            chroms = frames[uid] = sampleData.get_chromatograms(chromatogram)
 
-            chroms = sampleData.get_chromatograms(chromatogram)
+            by_length = {}
             for name, df in chroms.items():
-                # print(f"\t> Correcting {name} chromatogram")
-
-                if chromatogram == "xic":
-                    col_name = "intensity"
-                else:
-                    col_name = chromatogram
-                baseline, corrected = bc.asls(df[col_name], **correction_params)
-
-                df = df.copy()
+                if cache is not None:
+                    keys[uid, name] = cache.key(self._method, df[col_name].to_numpy(dtype=np.float64),
+                                                df["retention_time"].to_numpy(), correction_params)
+                    cached = cache.get(keys[uid, name])
+                    if cached is not None:
+                        corrections[uid, name] = cached
+                        continue
+                by_length.setdefault(len(df), []).append(name)
+
+            for names in by_length.values():
+                for i in range(0, len(names), batch_size):
+                    tasks.append((uid, names[i:i + batch_size], chroms))
+
+        def task_args(names, chroms):
+            intensities = np.vstack([chroms[name][col_name].to_numpy(dtype=np.float64) for name in names])
+            return self._method, intensities, chroms[names[0]]["retention_time"].to_numpy()
+
+        task_seconds = {}
+        pool_class = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        start = time.perf_counter()
+        with pool_class(max_workers=workers) if workers > 1 and tasks else nullcontext() as pool:
+            if pool is None:
+                outcomes = ((i, partial(correct_baseline_task, *task_args(names, chroms), **correction_params))
+                            for i, (uid, names, chroms) in enumerate(tasks))
+            else:
+                futures = {pool.submit(correct_baseline_task, *task_args(names, chroms), **correction_params): i
+                           for i, (uid, names, chroms) in enumerate(tasks)}
+                outcomes = ((futures[future], future.result) for future in as_completed(futures))
+
+            for n, (i, outcome) in enumerate(outcomes, start=1):
+                uid, names = tasks[i][:2]
+                try:
+                    baselines, corrected, task_seconds[i] = outcome()
+                except Exception as e:
+                    failed[uid] = e
+                    print(f"\t \033[31m x \033[0m[{n}/{len(tasks)}] {uid}: {type(e).__name__}: {e}")
+                    continue
+                for name, baseline, corrected_row in zip(names, baselines, corrected):
+                    corrections[uid, name] = baseline, corrected_row
+                    if cache is not None:
+                        cache.put(keys[uid, name], baseline, corrected_row)
+                print(f"\t \033[32m ✓ \033[0m[{n}/{len(tasks)}] {uid} ({len(names)} chromatograms, {task_seconds[i]:.3f} s)")
+        elapsed = time.perf_counter() - start
+
+        # merge in sample and chromatogram order, so the result does not depend on which task finished first
+        for uid, chroms in frames.items():
+            if uid in failed:
+                continue
+            for name in chroms:
+                baseline, corrected = corrections[uid, name]
+                df = chroms[name].copy()
                 df["baseline"] = baseline
                 df["corrected"] = corrected
 
-                sampleData.add_chromatograms(chromatogram, name, df)
-            print(f"\t \033[32m ✓ \033[0m{sampleData.unique_id}")
+                self.samples[uid].add_chromatograms(chromatogram, name, df)
+
+        print(f"\t> {len(task_seconds)} baseline tasks: {sum(task_seconds.values()):.3f} s in tasks, {elapsed:.3f} s wall time "
+              f"({workers} {executor} workers)")
+        if cache is not None:
+            print(f"\t> {cache}")
+        if failed:
+            print(f"\t> {len(failed)} of {len(self.samples)} samples failed baseline correction: {', '.join(failed)}")
+
+        return failed
 
     def peak_detection(self):
         log_method_entry()
@@ -160,6 +484,35 @@ class Ionome:
                         sampleData.peaks_properties[metabolite] = peak_properties
                         sampleData.unmixed_chromatograms[metabolite] = unmixed_chromatogram
 
+        if peak_detect_cfg.get("rois", False):
+            self._detect_roi_peaks(peak_detect_cfg)
+
+    def _detect_roi_peaks(self, peak_detect_cfg: dict):
+        """
+        Runs DetectPeaks on the baseline corrected ROI traces (correct_baseline("roi")) of every
+        sample; results are stored under the ROI name next to the XIC results.
+        """
+        print(f"\t> Detecting peaks in ROI traces:")
+        for uid, sampleData in self.samples.items():
+            if not sampleData.roi_traces:
+                print(f"\t \033[31m x \033[0m{uid}: no ROI traces, skipping")
+                continue
+
+            detected = 0
+            for name, roi_df in sampleData.roi_traces.items():
+                if "corrected" not in roi_df.columns:
+                    continue
+                try:
+                    window_df_props, peak_properties, unmixed_chromatogram = DetectPeaks(name, roi_df, **peak_detect_cfg).detect_peaks()
+                except Exception as e:
+                    print(f"\t \033[31m x \033[0m{uid} {name}: {type(e).__name__}: {e}")
+                    continue
+                sampleData.window_df_properties[name] = window_df_props
+                sampleData.peaks_properties[name] = peak_properties
+                sampleData.unmixed_chromatograms[name] = unmixed_chromatogram
+                detected += 1
+            print(f"\t \033[32m ✓ \033[0m{uid} ({detected} of {len(sampleData.roi_traces)} ROI traces)")
+
     def plot_chromatogram(self, type_plot: str = "tic"):
         """
         Default is ....?.
@@ -2,11 +2,612 @@
 Class method for parsing mzml file format of LCMS data.
 Returns dataframe
 """
+import binascii
+import hashlib
+import json
+import re
+import shutil
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree as ET
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pymzml
 from src.paths import output_path
+from src.spectrum_store import SpectrumStore, store_path
+from src.stream_accumulator import ScanAccumulator
 from pathlib import Path
 
+RAW_COLUMNS = ["ms_level", "scan_id", "retention_time", "intensity", "mz", "scan_idx"]
+
+# Per-scan side table, scan_idx is the position of the scan in the file (0-based)
+SCAN_COLUMNS = ["scan_idx", "scan_id", "retention_time", "ms_level", "n_peaks"]
+
+# Peak columns kept in memory for a compact SampleData.raw
+COMPACT_COLUMNS = ["scan_idx", "mz", "intensity"]
+
+# Bump when the layout of the cached parquet files changes
+CACHE_FORMAT_VERSION = 2
+
+# Schema metadata key recording how the cached peak table is sorted
+CACHE_SORT_KEY = b"ionome_cache_sort"
+
+# Parser settings that change how the cache is produced but not its content
+EXECUTION_SETTINGS = {"parse_mode", "workers", "stream", "row_group_size", "hash_content", "compact", "float32_intensity",
+                      "cache_backend", "reader", "chunk_workers", "keep_raw"}
+
+# PSI-MS cvParam accessions read by the fast mzML reader
+MS_LEVEL = "MS:1000511"
+SCAN_START_TIME = "MS:1000016"
+MZ_ARRAY = "MS:1000514"
+INTENSITY_ARRAY = "MS:1000515"
+BINARY_DTYPES = {"MS:1000521": "<f4", "MS:1000523": "<f8", "MS:1000519": "<i4", "MS:1000522": "<i8"}
+ZLIB_COMPRESSION = "MS:1000574"
+NO_COMPRESSION = "MS:1000576"
+TIME_UNITS_IN_MINUTES = {"millisecond": 1 / 60000, "second": 1 / 60, "minute": 1, "hour": 60}
+
+# Same native id rule as pymzml's spectrum.ID: the number after the last '='
+SPECTRUM_ID_PATTERN = re.compile(r'="?([0-9]*)"?>?$')
+
+
+class UnsupportedEncodingError(ValueError):
+    """Binary array encoding (e.g. MS-Numpress) the fast reader cannot decode."""
+
+
+def file_sha256(path: Path, chunk_size: int = 8 * 1024 ** 2) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_parquet_cache(df: pd.DataFrame, parquet_path: Path, row_group_size: int, cache_sort: str = "retention_time"):
+    """
+    Writes the peak table to parquet in row groups with min/max statistics.
+
+    cache_sort 'retention_time' keeps scan order, so RT windows only touch a few row groups.
+    cache_sort 'mz' sorts by m/z, so XIC windows only touch a few row groups; the sort is
+    recorded in the schema metadata and read_cache restores scan order on load.
+    """
+    if cache_sort == "mz":
+        df = df.sort_values("mz", kind="stable", ignore_index=True)
+    elif cache_sort != "retention_time":
+        raise ValueError(f"Unknown cache sort: {cache_sort}")
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), CACHE_SORT_KEY: cache_sort.encode()})
+    pq.write_table(table, parquet_path, row_group_size=int(row_group_size), write_statistics=True)
+
+
+def read_cache(parquet_path: Path, columns: list[str] | None = None, filters=None) -> pd.DataFrame:
+    """
+    Loads a parquet cache in scan order. Only the requested columns are read and
+    'filters' (pyarrow filter expressions) skip row groups using their statistics.
+    """
+    return _in_scan_order(pq.read_table(parquet_path, columns=columns, filters=filters))
+
+
+def _in_scan_order(table: pa.Table) -> pd.DataFrame:
+    """The rows of a table read from a parquet cache as a DataFrame, back in scan order for an m/z sorted cache."""
+    df = table.to_pandas()
+
+    cache_sort = (table.schema.metadata or {}).get(CACHE_SORT_KEY, b"retention_time").decode()
+    if cache_sort == "mz" and "scan_idx" in df.columns:
+        df = df.sort_values("scan_idx", kind="stable", ignore_index=True)
+
+    return df
+
+
+def load_cached_sample(parquet_path: Path, compact: bool = False, float32_intensity: bool = True) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Loads the SampleData.raw peak table (full or compact) and the per-scan table of a parquet cache."""
+    if compact:
+        return read_compact_cache(parquet_path, float32_intensity)
+    return read_cache(parquet_path), read_scans(parquet_path)
+
+
+def scans_path(parquet_path: Path) -> Path:
+    """Path of the per-scan side table stored next to a parquet cache."""
+    return parquet_path.with_suffix(".scans.parquet")
+
+
+def read_scans(parquet_path: Path) -> pd.DataFrame:
+    """Loads the per-scan table (scan_idx, scan_id, retention_time, ms_level, n_peaks) of a parquet cache."""
+    return pd.read_parquet(scans_path(parquet_path))
+
+
+def read_compact_cache(parquet_path: Path, float32_intensity: bool = True) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Loads a parquet cache as a compact peak table (int32 scan_idx, mz, intensity)
+    plus the per-scan table, instead of repeating scan_id, retention_time and
+    ms_level on every peak row. Only the compact columns are read from parquet.
+    """
+    peaks = read_cache(parquet_path, columns=COMPACT_COLUMNS)
+    peaks["scan_idx"] = peaks["scan_idx"].astype(np.int32, copy=False)
+    if float32_intensity:
+        peaks["intensity"] = peaks["intensity"].astype(np.float32, copy=False)
+
+    return peaks, read_scans(parquet_path)
+
+
+def read_mz_window(parquet_path: Path, mz_min: float, mz_max: float, columns: list[str] | None = None) -> pd.DataFrame:
+    """Reads only the peaks with mz_min <= mz <= mz_max from a parquet cache."""
+    return read_cache(parquet_path, columns=columns, filters=[("mz", ">=", mz_min), ("mz", "<=", mz_max)])
+
+
+def read_mz_windows(parquet_path: Path, mz_min: np.ndarray, mz_max: np.ndarray, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Reads the peaks inside any of the mz_min[i] <= mz <= mz_max[i] windows from a parquet
+    cache. Only row groups whose m/z statistics overlap a window are read; the peaks are
+    then matched with one np.searchsorted over the sorted windows instead of a filter per
+    window, which costs rows x windows comparisons.
+    """
+    parquet_file = pq.ParquetFile(parquet_path)
+    order = np.argsort(mz_min, kind="stable")
+    # windows sorted by lower bound, with the highest upper bound reached so far: a value lies
+    # in a window when the last window starting at or below it reaches it
+    starts = np.asarray(mz_min, dtype=np.float64)[order]
+    reach = np.maximum.accumulate(np.asarray(mz_max, dtype=np.float64)[order])
+
+    mz_column = parquet_file.schema_arrow.get_field_index("mz")
+    row_groups = []
+    for i in range(parquet_file.metadata.num_row_groups):
+        statistics = parquet_file.metadata.row_group(i).column(mz_column).statistics
+        if statistics is None or not statistics.has_min_max:
+            row_groups.append(i)
+            continue
+        n_started = np.searchsorted(starts, statistics.max, side="right")
+        if n_started > 0 and reach[n_started - 1] >= statistics.min:
+            row_groups.append(i)
+
+    read_columns = None if columns is None else list(dict.fromkeys([*columns, "mz"]))
+    table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+
+    mz = table.column("mz").to_numpy()
+    n_started = np.searchsorted(starts, mz, side="right")
+    inside = (n_started > 0) & (reach[np.maximum(n_started - 1, 0)] >= mz) if len(starts) else np.zeros(len(mz), dtype=bool)
+    table = table.filter(pa.array(inside))
+
+    return _in_scan_order(table.select(columns) if columns is not None else table)
+
+
+def read_rt_window(parquet_path: Path, rt_min: float, rt_max: float, columns: list[str] | None = None) -> pd.DataFrame:
+    """Reads only the peaks with rt_min <= retention_time <= rt_max from a parquet cache."""
+    return read_cache(parquet_path, columns=columns, filters=[("retention_time", ">=", rt_min), ("retention_time", "<=", rt_max)])
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def native_id(spectrum_id: str) -> int | str:
+    match = SPECTRUM_ID_PATTERN.search(spectrum_id)
+    if match is None:
+        return spectrum_id
+    try:
+        return int(match.group(1))
+    except ValueError:
+        return match.group(1)
+
+
+def decode_binary_array(element: ET.Element) -> tuple[str | None, np.ndarray]:
+    """Decodes a <binaryDataArray> straight into NumPy, returns (array accession, values)."""
+    array_type, dtype, compression, text = None, None, None, None
+    for child in element:
+        tag = _local_name(child.tag)
+        if tag == "binary":
+            text = child.text
+        elif tag == "cvParam":
+            accession = child.get("accession")
+            if accession in (MZ_ARRAY, INTENSITY_ARRAY):
+                array_type = accession
+            elif accession in BINARY_DTYPES:
+                dtype = BINARY_DTYPES[accession]
+            elif accession in (ZLIB_COMPRESSION, NO_COMPRESSION):
+                compression = accession
+            elif "compression" in child.get("name", "").lower() or "numpress" in child.get("name", "").lower():
+                raise UnsupportedEncodingError(f"Unsupported binary encoding: {child.get('name')} ({accession})")
+
+    if array_type is None:
+        return None, np.empty(0)
+    if dtype is None:
+        raise UnsupportedEncodingError("Binary data array without a numeric data type")
+
+    data = binascii.a2b_base64(text) if text else b""
+    if data and compression == ZLIB_COMPRESSION:
+        data = zlib.decompress(data)
+
+    return array_type, np.frombuffer(data, dtype=dtype)
+
+
+def decode_spectrum(element: ET.Element, ms_level: int | None = None):
+    """
+    Decodes a <spectrum> element into (scan_id, retention_time, ms_level, mz, intensity),
+    retention time in minutes. Only the ms level, scan start time and id are read, the
+    binary arrays are skipped (None is returned) when the spectrum is not at ms_level.
+    Tags are matched by local name so elements with or without namespace both work.
+    """
+    level, retention_time = None, None
+    for child in element.iter():
+        if _local_name(child.tag) != "cvParam":
+            continue
+        accession = child.get("accession")
+        if accession == MS_LEVEL:
+            level = int(child.get("value"))
+        elif accession == SCAN_START_TIME:
+            unit = child.get("unitName", "unicorns").lower()
+            if unit not in TIME_UNITS_IN_MINUTES:
+                raise ValueError(f"Time unit '{unit}' unknown")
+            retention_time = float(child.get("value")) * TIME_UNITS_IN_MINUTES[unit]
+        if level is not None and retention_time is not None:
+            break
+
+    if ms_level is not None and level != ms_level:
+        return None
+
+    arrays = {}
+    for child in element.iter():
+        if _local_name(child.tag) == "binaryDataArray":
+            array_type, values = decode_binary_array(child)
+            arrays[array_type] = values
+
+    return (native_id(element.get("id")),
+            retention_time,
+            level,
+            arrays.get(MZ_ARRAY, np.empty(0, dtype=np.float64)),
+            arrays.get(INTENSITY_ARRAY, np.empty(0, dtype=np.float32)))
+
+
+def iter_mzml_spectra(mzml_file: str | Path, ms_level: int | None = None):
+    """
+    Fast mzML reader, streams <spectrum> elements with ElementTree.iterparse and
+    yields decode_spectrum tuples for those at ms_level. Processed elements are
+    dropped from the tree so memory does not grow with the file.
+    """
+    parent = None
+    for event, element in ET.iterparse(mzml_file, events=("start", "end")):
+        tag = _local_name(element.tag)
+        if event == "start":
+            if tag in ("spectrumList", "chromatogramList"):
+                parent = element
+            continue
+
+        if tag == "spectrum":
+            spectrum = decode_spectrum(element, ms_level)
+            parent.remove(element)
+            if spectrum is not None:
+                yield spectrum
+        elif tag == "chromatogram":
+            parent.remove(element)
+
+
+def fast_reader_supported(mzml_file: str | Path) -> bool:
+    """Decodes the first spectrum to check the file's binary encoding works with the fast reader."""
+    try:
+        next(iter_mzml_spectra(mzml_file), None)
+    except UnsupportedEncodingError:
+        return False
+    return True
+
+
+def read_spectrum_element(f, offset: int, size: int = 1024 ** 2) -> ET.Element:
+    """
+    Parses the <spectrum> element starting at byte offset of the open binary file f.
+    size is a first guess of the element length (the distance to the next offset),
+    more is read until the closing tag is found.
+    """
+    f.seek(offset)
+    data = f.read(size)
+    end = data.find(b"</spectrum>")
+    while end < 0:
+        chunk = f.read(1024 ** 2)
+        if not chunk:
+            raise ValueError(f"Spectrum at byte {offset} of {f.name} is not terminated")
+        data += chunk
+        end = data.find(b"</spectrum>")
+
+    return ET.fromstring(data[:end + len(b"</spectrum>")])
+
+
+def decode_spectra_at(mzml_file: str | Path, offsets: np.ndarray, sizes: np.ndarray, ms_level: int | None = None) -> list[tuple]:
+    """
+    Process pool entry point for parallel parsing of one file, decodes the spectra
+    at the given byte offsets and returns the decode_spectrum tuples at ms_level.
+    """
+    spectra = []
+    with open(mzml_file, "rb") as f:
+        for offset, size in zip(offsets, sizes):
+            spectrum = decode_spectrum(read_spectrum_element(f, int(offset), int(size)), ms_level)
+            if spectrum is not None:
+                spectra.append(spectrum)
+    return spectra
+
+
+class MzmlSpectrumIndex:
+    """
+    Byte offsets of the <spectrum> elements of an mzML file, read from the
+    indexedmzML <indexList> or, when the file has none (or a stale one), built
+    by scanning the file for spectrum start tags. Spectra are read by seeking
+    to their offset and decoding the element on its own with decode_spectrum.
+    """
+    _OFFSET_PATTERN = re.compile(rb'<offset\s+idRef="([^"]*)"[^>]*>\s*(\d+)\s*</offset>')
+    _SPECTRUM_TAG = re.compile(rb'<spectrum\s[^>]*>')
+    _ID_ATTRIBUTE = re.compile(rb'\sid="([^"]*)"')
+
+    def __init__(self, mzml_file: str | Path):
+        self.mzml_file = Path(mzml_file)
+        index = self._read_index_list()
+        if index is None:
+            index = self._build_index()
+        self.ids, self.offsets = index
+        self.scan_ids = [native_id(i) for i in self.ids]
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def _read_index_list(self, tail_size: int = 4096) -> tuple[list[str], np.ndarray] | None:
+        with open(self.mzml_file, "rb") as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(size - tail_size, 0))
+            match = re.search(rb"<indexListOffset>\s*(\d+)\s*</indexListOffset>", f.read())
+            if match is None or int(match.group(1)) >= size:
+                return None
+
+            f.seek(int(match.group(1)))
+            index_list = f.read()
+
+        start = index_list.find(b'<index name="spectrum"')
+        if start < 0:
+            return None
+        end = index_list.find(b"</index>", start)
+        entries = self._OFFSET_PATTERN.findall(index_list[start:end])
+        if not entries:
+            return None
+
+        ids = [entry[0].decode() for entry in entries]
+        offsets = np.array([int(entry[1]) for entry in entries], dtype=np.int64)
+
+        # files rewritten without updating the index keep offsets that no longer point to spectra
+        with open(self.mzml_file, "rb") as f:
+            for offset in (offsets[0], offsets[-1]):
+                f.seek(offset)
+                if not f.read(10).startswith(b"<spectrum"):
+                    return None
+
+        return ids, offsets
+
+    def _build_index(self, chunk_size: int = 16 * 1024 ** 2, overlap: int = 4096) -> tuple[list[str], np.ndarray]:
+        ids, offsets = [], []
+        with open(self.mzml_file, "rb") as f:
+            position, buffer = 0, b""
+            while True:
+                chunk = f.read(chunk_size)
+                buffer += chunk
+                # tags starting near the end of the buffer may be cut, they are matched with the next chunk
+                limit = len(buffer) if not chunk else len(buffer) - overlap
+                consumed = 0
+                for match in self._SPECTRUM_TAG.finditer(buffer):
+                    if match.start() >= limit:
+                        break
+                    id_match = self._ID_ATTRIBUTE.search(match.group(0))
+                    ids.append(id_match.group(1).decode() if id_match else "")
+                    offsets.append(position + match.start())
+                    consumed = match.end()
+                if not chunk:
+                    break
+                consumed = max(consumed, limit)
+                position += consumed
+                buffer = buffer[consumed:]
+
+        return ids, np.array(offsets, dtype=np.int64)
+
+    def sizes(self, positions) -> np.ndarray:
+        """Distance from each spectrum's offset to the next one, a read size hint for read_spectrum_element."""
+        next_offsets = np.append(self.offsets[1:], self.offsets[-1] + 1024 ** 2) if len(self) else self.offsets
+        return (next_offsets - self.offsets)[positions]
+
+    def read_element(self, f, i: int) -> ET.Element:
+        """Parses spectrum i from the open binary file f."""
+        return read_spectrum_element(f, int(self.offsets[i]), int(self.sizes([i])[0]))
+
+    def retention_time(self, f, i: int) -> float:
+        """Scan start time of spectrum i in minutes, without decoding its binary arrays."""
+        element = self.read_element(f, i)
+        for child in element.iter():
+            if _local_name(child.tag) == "cvParam" and child.get("accession") == SCAN_START_TIME:
+                unit = child.get("unitName", "unicorns").lower()
+                if unit not in TIME_UNITS_IN_MINUTES:
+                    raise ValueError(f"Time unit '{unit}' unknown")
+                return float(child.get("value")) * TIME_UNITS_IN_MINUTES[unit]
+        raise ValueError(f"Spectrum {self.ids[i]} has no scan start time")
+
+    def rt_positions(self, rt_min: float, rt_max: float) -> np.ndarray:
+        """
+        Positions of the spectra with rt_min <= retention time <= rt_max, found by
+        binary search over the offsets, as spectra are stored in acquisition order.
+        """
+        with open(self.mzml_file, "rb") as f:
+            def bisect(rt, right):
+                lo, hi = 0, len(self)
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    rt_mid = self.retention_time(f, mid)
+                    if rt_mid < rt or (right and rt_mid == rt):
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                return lo
+
+            return np.arange(bisect(rt_min, right=False), bisect(rt_max, right=True))
+
+    def scan_positions(self, first_scan: int, last_scan: int) -> np.ndarray:
+        """Positions of the spectra with first_scan <= native scan id <= last_scan."""
+        return np.array([i for i, scan_id in enumerate(self.scan_ids)
+                         if isinstance(scan_id, int) and first_scan <= scan_id <= last_scan], dtype=np.int64)
+
+    def select(self, rt_range=None, scan_range=None) -> np.ndarray:
+        """Positions of the spectra inside both the RT range (minutes) and the scan range, when given."""
+        positions = np.arange(len(self))
+        if rt_range is not None:
+            positions = self.rt_positions(*rt_range)
+        if scan_range is not None:
+            positions = np.intersect1d(positions, self.scan_positions(*scan_range))
+        return positions
+
+    def iter_spectra(self, positions, ms_level: int | None = None):
+        """Yields decode_spectrum tuples of the spectra at the given positions and ms_level."""
+        with open(self.mzml_file, "rb") as f:
+            for i in positions:
+                spectrum = decode_spectrum(self.read_element(f, i), ms_level)
+                if spectrum is not None:
+                    yield spectrum
+
+    def byte_chunks(self, positions, n_chunks: int) -> list[np.ndarray]:
+        """Splits the positions into up to n_chunks contiguous runs holding about the same number of bytes."""
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return []
+        ends = np.cumsum(self.sizes(positions))
+        bounds = np.searchsorted(ends, np.linspace(0, ends[-1], n_chunks + 1)[1:-1], side="right")
+        return [chunk for chunk in np.split(positions, np.unique(bounds)) if len(chunk)]
+
+    def iter_spectra_parallel(self, positions, ms_level: int | None, workers: int, chunks_per_worker: int = 4):
+        """
+        Same spectra as iter_spectra, decoded by a process pool in contiguous byte
+        chunks. Chunks are yielded in file order, and at most two per worker are
+        pending at a time so memory stays bounded for large files.
+        """
+        chunks = self.byte_chunks(positions, workers * chunks_per_worker)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(decode_spectra_at, self.mzml_file, self.offsets[chunk], self.sizes(chunk), ms_level))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+
+def iter_cache_arrays(parquet_path: Path):
+    """Yields (mz, intensity) arrays of a parquet cache in scan order, one row group at a time."""
+    parquet_file = pq.ParquetFile(parquet_path)
+    cache_sort = (parquet_file.schema_arrow.metadata or {}).get(CACHE_SORT_KEY, b"retention_time").decode()
+
+    # an m/z sorted cache has to be put back in scan order as a whole
+    if cache_sort == "mz":
+        peaks = read_cache(parquet_path, columns=COMPACT_COLUMNS)
+        yield peaks["mz"].to_numpy(), peaks["intensity"].to_numpy()
+        return
+
+    for i in range(parquet_file.num_row_groups):
+        table = parquet_file.read_row_group(i, columns=["mz", "intensity"])
+        yield table.column("mz").to_numpy(), table.column("intensity").to_numpy()
+
+
+def build_spectrum_store(parquet_path: Path) -> SpectrumStore:
+    """Writes the memory-mapped CSR spectrum store of a parquet cache next to it."""
+    return SpectrumStore.write(store_path(parquet_path), read_scans(parquet_path), iter_cache_arrays(parquet_path))
+
+
+def spectra_to_frame(scan_ids, retention_times, ms_levels, mz_arrays, intensity_arrays, first_scan_idx: int = 0) -> pd.DataFrame:
+    """
+    Builds the long peak table from per-scan arrays with a single concatenation.
+
+    The scan level values (scan_id, retention_time, ms_level, scan_idx) are repeated
+    over each scan's peaks using the scan offsets, instead of one dict per peak.
+    """
+    counts = np.fromiter((len(mz) for mz in mz_arrays), dtype=np.int64, count=len(mz_arrays))
+    scan_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=scan_offsets[1:])
+
+    if scan_offsets[-1] == 0:
+        return pd.DataFrame(columns=RAW_COLUMNS)
+
+    return pd.DataFrame({
+        "ms_level": np.repeat(np.asarray(ms_levels, dtype=np.int64), counts),
+        "scan_id": np.repeat(np.asarray(scan_ids), counts),
+        "retention_time": np.repeat(np.asarray(retention_times, dtype=np.float64), counts),
+        "intensity": np.concatenate(intensity_arrays),
+        "mz": np.concatenate(mz_arrays),
+        "scan_idx": np.repeat(np.arange(first_scan_idx, first_scan_idx + len(counts), dtype=np.int32), counts),
+    })
+
+
+def spectra_to_scans(scan_ids, retention_times, ms_levels, mz_arrays, first_scan_idx: int = 0) -> pd.DataFrame:
+    """Builds the per-scan side table, including scans without peaks."""
+    return pd.DataFrame({
+        "scan_idx": np.arange(first_scan_idx, first_scan_idx + len(scan_ids), dtype=np.int32),
+        "scan_id": np.asarray(scan_ids),
+        "retention_time": np.asarray(retention_times, dtype=np.float64),
+        "ms_level": np.asarray(ms_levels, dtype=np.int64),
+        "n_peaks": np.fromiter((len(mz) for mz in mz_arrays), dtype=np.int64, count=len(mz_arrays)),
+    }, columns=SCAN_COLUMNS)
+
+
+def scans_from_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-scan side table of an already built peak table (only scans with peaks).
+    Adds scan_idx to the frame, in order of appearance, when it is missing.
+    """
+    if "scan_idx" not in df.columns:
+        df["scan_idx"] = pd.factorize(df["scan_id"])[0].astype(np.int32)
+
+    scans = df.groupby("scan_idx", sort=True).agg(
+        scan_id=("scan_id", "first"),
+        retention_time=("retention_time", "first"),
+        ms_level=("ms_level", "first"),
+        n_peaks=("mz", "size"),
+    ).reset_index()
+
+    return scans[SCAN_COLUMNS]
+
+
+class ParquetStreamWriter:
+    """
+    Appends peak table chunks to a parquet file in row groups of a fixed size.
+    Rows beyond the last full row group are carried over to the next chunk, so
+    at most one row group plus one chunk is held in memory at any time.
+    The file is written to a temporary path and moved in place on close.
+    """
+    def __init__(self, parquet_path: Path, row_group_size: int):
+        self.parquet_path = parquet_path
+        self.row_group_size = int(row_group_size)
+        self._tmp_path = parquet_path.with_name(parquet_path.name + ".tmp")
+        self._writer = None
+        self._carry = None
+
+    def write_frame(self, df: pd.DataFrame):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._tmp_path, table.schema)
+        else:
+            table = table.cast(self._writer.schema, safe=False)
+
+        if self._carry is not None:
+            table = pa.concat_tables([self._carry, table])
+
+        n_full = (len(table) // self.row_group_size) * self.row_group_size
+        if n_full:
+            self._writer.write_table(table.slice(0, n_full), row_group_size=self.row_group_size)
+        self._carry = table.slice(n_full)
+
+    def close(self) -> Path:
+        if self._writer is None:
+            pd.DataFrame(columns=RAW_COLUMNS).to_parquet(self._tmp_path, index=False)
+        else:
+            if self._carry is not None and len(self._carry):
+                self._writer.write_table(self._carry, row_group_size=self.row_group_size)
+            self._writer.close()
+
+        self._tmp_path.replace(self.parquet_path)
+        return self.parquet_path
+
+
 class MzmlParser:
     def __init__(self,
                  mzml_file: str | Path,
@@ -18,7 +619,108 @@ class MzmlParser:
         self._settings = parser_cfg
         self.run_id = run_id
 
+    def iter_spectra(self):
+        """
+        Yields (scan_id, retention_time, ms_level, mz, intensity) for every spectrum
+        of the configured ms level, with mz/intensity as NumPy arrays.
+
+        reader 'fast' decodes the binary arrays directly (iter_mzml_spectra),
+        'pymzml' (default) goes through pymzml Spectrum objects and is used as
+        fallback when the fast reader does not support the file's encoding.
+
+        With parser.rt_range and/or parser.scan_range set, only the spectra inside
+        the range are read, by seeking through the mzML spectrum offset index.
+        With parser.chunk_workers > 1 the file is split into contiguous byte ranges
+        of the offset index, decoded in a process pool and merged back in scan order.
+        """
+        rt_range, scan_range = self._settings.get("rt_range"), self._settings.get("scan_range")
+        chunk_workers = int(self._settings.get("chunk_workers", 1))
+        if rt_range is not None or scan_range is not None or chunk_workers > 1:
+            if fast_reader_supported(self.mzml_file):
+                index = MzmlSpectrumIndex(self.mzml_file)
+                positions = index.select(rt_range, scan_range)
+                if chunk_workers > 1:
+                    yield from index.iter_spectra_parallel(positions, self._settings.get("ms_level"), chunk_workers)
+                else:
+                    yield from index.iter_spectra(positions, self._settings.get("ms_level"))
+                return
+            print(f"\t  {Path(self.mzml_file).name}: encoding not supported for indexed reads, using pymzml")
+
+        if self._settings.get("reader", "pymzml") == "fast":
+            if fast_reader_supported(self.mzml_file):
+                yield from iter_mzml_spectra(self.mzml_file, self._settings.get("ms_level"))
+                return
+            print(f"\t  {Path(self.mzml_file).name}: encoding not supported by the fast reader, using pymzml")
+
+        reader = pymzml.run.Reader(self.mzml_file)
+        for spec in reader:
+            if spec.ms_level != self._settings.get("ms_level"):
+                continue
+            if not self.in_range(spec.ID, spec.scan_time_in_minutes()):
+                continue
+
+            yield spec.ID, spec.scan_time_in_minutes(), spec.ms_level, np.asarray(spec.mz), np.asarray(spec.i)
+
+    def in_range(self, scan_id, retention_time: float) -> bool:
+        """True when a spectrum falls inside the configured rt_range and scan_range (inclusive)."""
+        rt_range, scan_range = self._settings.get("rt_range"), self._settings.get("scan_range")
+        if rt_range is not None and not rt_range[0] <= retention_time <= rt_range[1]:
+            return False
+        if scan_range is not None and not (isinstance(scan_id, int) and scan_range[0] <= scan_id <= scan_range[1]):
+            return False
+        return True
+
+    @property
+    def range_tag(self) -> str:
+        """Cache name suffix of a partial load, e.g. '.rt_5-8' or '.scan_100-500'."""
+        tag = ""
+        if self._settings.get("rt_range") is not None:
+            rt_min, rt_max = self._settings["rt_range"]
+            tag += f".rt_{float(rt_min):g}-{float(rt_max):g}"
+        if self._settings.get("scan_range") is not None:
+            first_scan, last_scan = self._settings["scan_range"]
+            tag += f".scan_{int(first_scan)}-{int(last_scan)}"
+        return tag
+
+    def accumulate(self, accumulator: ScanAccumulator) -> ScanAccumulator:
+        """Feeds every spectrum to the accumulator in a single read of the file, nothing is cached."""
+        for spectrum in self.iter_spectra():
+            accumulator.add(*spectrum)
+        return accumulator
+
     def parse_mzml_file(self, **kwargs):
+        """
+        Parses the mzML file into the long peak table.
+
+        parse_mode 'columnar' (default) collects each spectrum as NumPy arrays and
+        builds the frame in one concatenation, 'rows' is the original one dict per peak path.
+        """
+        parse_mode = kwargs.get("parse_mode", self._settings.get("parse_mode", "columnar"))
+
+        if parse_mode == "columnar":
+            return self._parse_columnar()
+        elif parse_mode == "rows":
+            return self._parse_rows()
+        else:
+            raise ValueError(f"Unknown parse mode: {parse_mode}")
+
+    def parse_spectra(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Columnar parse returning the peak table and the per-scan side table."""
+        scan_ids, retention_times, ms_levels, mz_arrays, intensity_arrays = [], [], [], [], []
+        for scan_id, rt, ms_level, mz, intensity in self.iter_spectra():
+            scan_ids.append(scan_id)
+            retention_times.append(rt)
+            ms_levels.append(ms_level)
+            mz_arrays.append(mz)
+            intensity_arrays.append(intensity)
+
+        return (spectra_to_frame(scan_ids, retention_times, ms_levels, mz_arrays, intensity_arrays),
+                spectra_to_scans(scan_ids, retention_times, ms_levels, mz_arrays))
+
+    def _parse_columnar(self):
+        return self.parse_spectra()[0]
+
+    def _parse_rows(self):
 
         rows = []
         reader = pymzml.run.Reader(self.mzml_file)
@@ -28,6 +730,8 @@ class MzmlParser:
 
             rt = spec.scan_time_in_minutes()
             scan_id = spec.ID
+            if not self.in_range(scan_id, rt):
+                continue
 
             for intensity, mz in zip(spec.i, spec.mz):
                 rows.append({
@@ -41,6 +745,160 @@ class MzmlParser:
 
         return scans_df
 
+    @property
+    def cache_path(self) -> Path:
+        return output_path(self.run_id, "cached_dir") / self.mzml_file.name.replace(".mzML", f"{self.range_tag}.parquet")
+
+    @property
+    def scans_path(self) -> Path:
+        return scans_path(self.cache_path)
+
+    @property
+    def store_path(self) -> Path:
+        return store_path(self.cache_path)
+
+    def stream_to_parquet(self, parquet_path: Path) -> Path:
+        """
+        Writes the spectra to parquet while iterating the mzML file, flushing every
+        'row_group_size' peaks. Peak memory depends on the row group size, not the file size.
+        """
+        row_group_size = int(self._settings.get("row_group_size", 1_000_000))
+        writer = ParquetStreamWriter(parquet_path, row_group_size)
+
+        scans = []
+        buffer = ([], [], [], [], [])
+        n_buffered, first_scan_idx = 0, 0
+        for spectrum in self.iter_spectra():
+            for column, value in zip(buffer, spectrum):
+                column.append(value)
+            n_buffered += len(spectrum[3])
+
+            if n_buffered >= row_group_size:
+                writer.write_frame(spectra_to_frame(*buffer, first_scan_idx=first_scan_idx))
+                scans.append(spectra_to_scans(*buffer[:4], first_scan_idx=first_scan_idx))
+                first_scan_idx += len(buffer[0])
+                buffer = ([], [], [], [], [])
+                n_buffered = 0
+
+        if buffer[0]:
+            writer.write_frame(spectra_to_frame(*buffer, first_scan_idx=first_scan_idx))
+            scans.append(spectra_to_scans(*buffer[:4], first_scan_idx=first_scan_idx))
+
+        scans_df = pd.concat(scans, ignore_index=True) if scans else pd.DataFrame(columns=SCAN_COLUMNS)
+        scans_df.to_parquet(scans_path(parquet_path), index=False)
+
+        return writer.close()
+
+    @property
+    def fingerprint_path(self) -> Path:
+        return self.cache_path.with_suffix(".fingerprint.json")
+
+    def fingerprint(self, content_hash: bool | None = None) -> dict:
+        """
+        Identifies what a cache entry was built from: the mzML file (size, mtime and
+        optionally a sha256 of its content), the parser settings that change the
+        parsed output, and the cache format version.
+        """
+        if content_hash is None:
+            content_hash = self._settings.get("hash_content", False)
+
+        stat = Path(self.mzml_file).stat()
+        source = {"name": Path(self.mzml_file).name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if content_hash:
+            source["sha256"] = file_sha256(self.mzml_file)
+
+        parser = {k: v for k, v in sorted(self._settings.items()) if k not in EXECUTION_SETTINGS}
+
+        # Round trip through json so it compares equal to a stored fingerprint
+        return json.loads(json.dumps({
+            "format_version": CACHE_FORMAT_VERSION,
+            "source": source,
+            "parser": parser,
+        }, default=str))
+
+    def cache_is_valid(self) -> bool:
+        """
+        True when the parquet cache can be reused: rerun is False and the stored
+        fingerprint matches the current mzML file and parser settings.
+        """
+        if self._rerun or not self.fingerprint_path.exists():
+            return False
+        if not self.cache_path.exists() or not self.scans_path.exists():
+            return False
+
+        with open(self.fingerprint_path, "r") as f:
+            stored = json.load(f)
+
+        current = self.fingerprint(content_hash=False)
+        if stored.get("format_version") != current["format_version"] or stored.get("parser") != current["parser"]:
+            return False
+
+        stored_source, current_source = stored.get("source", {}), current["source"]
+        if stored_source.get("size") != current_source["size"]:
+            return False
+        if stored_source.get("mtime_ns") == current_source["mtime_ns"]:
+            return True
+
+        # mtime changed (file copied or touched), the content hash decides if it is still the same file
+        if self._settings.get("hash_content", False) and "sha256" in stored_source:
+            if file_sha256(self.mzml_file) == stored_source["sha256"]:
+                stored["source"]["mtime_ns"] = current_source["mtime_ns"]
+                with open(self.fingerprint_path, "w") as f:
+                    json.dump(stored, f, indent=2)
+                return True
+
+        return False
+
+    def write_cache(self, **kwargs) -> pd.DataFrame | None:
+        """
+        Parses the mzML file into the parquet cache and the per-scan side table,
+        and stores its fingerprint next to them.
+        Returns the parsed DataFrame, or None in streaming mode.
+        """
+        parquet_path = self.cache_path
+
+        # A cache without a fingerprint is never trusted, so an interrupted write is re-parsed
+        self.fingerprint_path.unlink(missing_ok=True)
+        shutil.rmtree(self.store_path, ignore_errors=True)
+
+        cache_sort = self._settings.get("cache_sort", "retention_time")
+        if self._settings.get("stream", False):
+            if cache_sort != "retention_time":
+                raise ValueError(f"Streaming writes the cache in scan order, cache_sort '{cache_sort}' needs parser.stream: false")
+            self.stream_to_parquet(parquet_path)
+            master_df = None
+        else:
+            if kwargs.get("parse_mode", self._settings.get("parse_mode", "columnar")) == "columnar":
+                master_df, scans_df = self.parse_spectra()
+            else:
+                master_df = self.parse_mzml_file(**kwargs)
+                scans_df = scans_from_frame(master_df)
+            write_parquet_cache(master_df, parquet_path, self._settings.get("row_group_size", 1_000_000), cache_sort)
+            scans_df.to_parquet(self.scans_path, index=False)
+
+        with open(self.fingerprint_path, "w") as f:
+            json.dump(self.fingerprint(), f, indent=2)
+
+        return master_df
+
+    def cache_mzml(self, **kwargs) -> Path:
+        """
+        Parses the mzML file into the parquet cache, unless the cached file
+        is still valid. With cache_backend 'npy' the spectrum store is built
+        from the parquet cache as well. Returns the parquet path.
+        """
+        cache_backend = self._settings.get("cache_backend", "parquet")
+        if cache_backend not in ("parquet", "npy"):
+            raise ValueError(f"Unknown cache backend: {cache_backend}")
+
+        if not self.cache_is_valid():
+            self.write_cache(**kwargs)
+
+        if cache_backend == "npy" and not self.store_path.exists():
+            build_spectrum_store(self.cache_path)
+
+        return self.cache_path
+
     def parse_or_load_mzml(self,**kwargs):
         """
         Parse mzML file into a master DataFrame or load cached Parquet version.
@@ -50,22 +908,64 @@ class MzmlParser:
         pd.DataFrame
             Parsed chromatogram and peak data
         """
-        parquet_path = output_path(self.run_id, "cached_dir") / self.mzml_file.name.replace(".mzML",".parquet")
+        parquet_path = self.cache_path
+
+        # If cached file is valid (unchanged mzML and parser settings, rerun=False) → load from parquet
+        if self.cache_is_valid():
+            print(f"\t \033[32m ✓ \033[0m{self.mzml_file.name}")
+            return read_cache(parquet_path)
+
+        # Otherwise, parse mzML → DataFrame and save to Parquet
+        master_df = self.write_cache(**kwargs)
+        print(f"\t ✓ {self.mzml_file.name}")
 
-        # parquet_path = self.mzml_file.with_suffix(".parquet")
-        # If cached file exists and rerun=False → load from parquet
+        # Streaming mode never holds the full table, load the written cache back
+        if master_df is None:
+            return read_cache(parquet_path)
 
-        if parquet_path.exists() and not self._rerun:
+        return master_df
+
+
+    def parse_or_load_compact(self, **kwargs) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Same as parse_or_load_mzml, but returns the compact peak table
+        (scan_idx, mz, intensity) and the per-scan table.
+        """
+        if self.cache_is_valid():
             print(f"\t \033[32m ✓ \033[0m{self.mzml_file.name}")
-            return pd.read_parquet(parquet_path)
+        else:
+            self.write_cache(**kwargs)
+            print(f"\t ✓ {self.mzml_file.name}")
 
+        return read_compact_cache(self.cache_path, self._settings.get("float32_intensity", True))
 
-        # Otherwise, parse mzML → DataFrame
-        # print(f"\t Parsing {self.mzml_file.name} ... ")
-        master_df = self.parse_mzml_file(**kwargs)
-        print(f"\t ✓ {self.mzml_file.name}")
 
-        # Save to Parquet, reuse if 'rerun' is False
-        master_df.to_parquet(parquet_path, index=False)
+    def parse_or_load_store(self, **kwargs) -> SpectrumStore:
+        """Same as parse_or_load_mzml, but opens the memory-mapped spectrum store instead of a DataFrame."""
+        cached = self.cache_is_valid() and self.store_path.exists()
+        self.cache_mzml(**kwargs)
+        if not self.store_path.exists():
+            build_spectrum_store(self.cache_path)
+        print(f"\t \033[32m ✓ \033[0m{self.mzml_file.name}" if cached else f"\t ✓ {self.mzml_file.name}")
+
+        return SpectrumStore(self.store_path)
+
+
+def cache_mzml_file(mzml_file: Path, run_id: str, rerun: bool, parser_cfg: dict, **kwargs) -> Path:
+    """
+    Process pool entry point for parallel loading, parses and caches a single
+    mzML file and returns the path of its parquet cache.
+    """
+    parser = MzmlParser(mzml_file, rerun=rerun, run_id=run_id, **parser_cfg)
+    return parser.cache_mzml(**kwargs)
+
 
-        return master_df
\ No newline at end of file
+def accumulate_mzml_file(mzml_file: Path, run_id: str, parser_cfg: dict, target_list: dict, tol: float, tol_type: str,
+                         aggregation: str = "sum"):
+    """
+    Process pool entry point for streaming loads, reads a single mzML file once and
+    returns its quality control frame and XIC matrix without building the peak table.
+    """
+    parser = MzmlParser(mzml_file, rerun=True, run_id=run_id, **parser_cfg)
+    accumulator = parser.accumulate(ScanAccumulator(target_list, tol, tol_type, aggregation))
+    return accumulator.quality_control(), accumulator.xic()
@@ -0,0 +1,196 @@
+"""
+Untargeted region of interest (ROI) detection, centWave style: centroids are linked
+into mass traces when their m/z agree within a ppm tolerance over consecutive scans.
+
+Scans are walked in order, each one vectorized over its centroids:
+    1. every centroid is linked to the open ROI with the nearest mean m/z (one
+       np.searchsorted against the open ROIs sorted by mean m/z) when it lies within
+       ppm of that mean; a ROI takes the most intense of the centroids linked to it,
+       the others are dropped, and centroids without a ROI open a new one
+    2. ROIs missing more than max_gap consecutive scans are closed
+    3. ROIs shorter than min_scans or below min_intensity are dropped
+Linking against the running ROI mean keeps a trace in one ROI in dense data, where
+the m/z sorted centroids of all scans are rarely more than ppm apart.
+The ROIs come back as a table and as RoiTraces, the same {name: DataFrame}
+mapping as SampleData.xic, so they go through baseline correction and, with
+peak_detection.rois, DetectPeaks.
+"""
+import numpy as np
+import pandas as pd
+
+from src.xic_matrix import TraceMapping
+
+ROI_COLUMNS = ["name", "mz", "mz_min", "mz_max", "scan_start", "scan_end", "apex_scan", "n_scans", "max_intensity", "area"]
+
+
+def _run_starts(*keys: np.ndarray) -> np.ndarray:
+    """True where any of the (sorted) keys changes from the previous element."""
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+        for key in keys:
+            change[1:] |= key[1:] != key[:-1]
+    return change
+
+
+def detect_rois(mz: np.ndarray,
+                intensity: np.ndarray,
+                scan_rows: np.ndarray,
+                ppm: float = 10,
+                min_scans: int = 5,
+                max_gap: int = 1,
+                min_intensity: float = 0,
+                noise: float = 0) -> tuple[pd.DataFrame, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Detects ROIs in a peak list. scan_rows is the position of each peak's scan on
+    the scan axis (0..n_scans - 1). Centroids below 'noise' are ignored.
+
+    Returns (rois, roi_offsets, roi_scan_rows, roi_intensity): one table row per ROI,
+    in the order the ROIs were opened (by first scan, then m/z), and, in CSR layout, the scan rows and intensities of ROI i at
+    roi_offsets[i]:roi_offsets[i + 1], in scan order.
+    """
+    mz, intensity = np.asarray(mz, dtype=np.float64), np.asarray(intensity, dtype=np.float64)
+    scan_rows = np.asarray(scan_rows, dtype=np.int64)
+    if noise > 0:
+        above = intensity >= noise
+        mz, intensity, scan_rows = mz[above], intensity[above], scan_rows[above]
+
+    by_scan = np.lexsort((mz, scan_rows))
+    mz, intensity, scan_rows = mz[by_scan], intensity[by_scan], scan_rows[by_scan]
+
+    # ROI of every centroid, -1 for centroids that lost their ROI to a more intense one of the same scan
+    trace_id = np.full(len(mz), -1, dtype=np.int64)
+    n_traces = 0
+
+    # open ROIs sorted by mean m/z: mean m/z, m/z sum, centroid count, ROI id and last scan row
+    open_mz, open_sum, open_count = np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    open_id, open_last = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    scan_starts = np.flatnonzero(_run_starts(scan_rows))
+    for start, end in zip(scan_starts, np.append(scan_starts[1:], len(mz))):
+        row = scan_rows[start]
+
+        # 2. close ROIs missing more than max_gap scans
+        alive = row - open_last <= max_gap + 1
+        if not alive.all():
+            open_mz, open_sum, open_count = open_mz[alive], open_sum[alive], open_count[alive]
+            open_id, open_last = open_id[alive], open_last[alive]
+
+        # 1. nearest open ROI of every centroid of the scan
+        scan_mz = mz[start:end]
+        linked = np.zeros(len(scan_mz), dtype=bool)
+        if len(open_mz):
+            right = np.minimum(np.searchsorted(open_mz, scan_mz), len(open_mz) - 1)
+            left = np.maximum(right - 1, 0)
+            nearest = np.where(np.abs(open_mz[left] - scan_mz) <= np.abs(open_mz[right] - scan_mz), left, right)
+            linked = np.abs(open_mz[nearest] - scan_mz) <= open_mz[nearest] * ppm * 1e-6
+
+            # the most intense centroid linked to a ROI extends it
+            candidates = np.flatnonzero(linked)
+            candidates = candidates[np.lexsort((-intensity[start + candidates], nearest[candidates]))]
+            best = candidates[_run_starts(nearest[candidates])]
+            roi = nearest[best]
+            trace_id[start + best] = open_id[roi]
+            open_sum[roi] += scan_mz[best]
+            open_count[roi] += 1
+            open_mz[roi] = open_sum[roi] / open_count[roi]
+            open_last[roi] = row
+
+        # centroids without a ROI open one
+        opened = np.flatnonzero(~linked)
+        trace_id[start + opened] = np.arange(n_traces, n_traces + len(opened))
+        n_traces += len(opened)
+
+        open_mz = np.concatenate([open_mz, scan_mz[opened]])
+        open_order = np.argsort(open_mz, kind="stable")
+        open_mz = open_mz[open_order]
+        open_sum = np.concatenate([open_sum, scan_mz[opened]])[open_order]
+        open_count = np.concatenate([open_count, np.ones(len(opened), dtype=np.int64)])[open_order]
+        open_id = np.concatenate([open_id, trace_id[start + opened]])[open_order]
+        open_last = np.concatenate([open_last, np.full(len(opened), row)])[open_order]
+
+    # centroids of each ROI in scan order
+    linked = np.flatnonzero(trace_id >= 0)
+    by_trace = linked[np.lexsort((scan_rows[linked], trace_id[linked]))]
+    trace_id, peak_rows, peak_mz, peak_intensity = trace_id[by_trace], scan_rows[by_trace], mz[by_trace], intensity[by_trace]
+
+    # 3. filter
+    starts = np.flatnonzero(_run_starts(trace_id))
+    if not len(starts):
+        return pd.DataFrame(columns=ROI_COLUMNS), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+    counts = np.diff(np.append(starts, len(peak_rows)))
+    max_intensity = np.maximum.reduceat(peak_intensity, starts)
+    area = np.add.reduceat(peak_intensity, starts)
+    keep = (counts >= min_scans) & (max_intensity >= min_intensity)
+
+    apex = np.flatnonzero(peak_intensity == np.repeat(max_intensity, counts))
+    apex = apex[_run_starts(np.searchsorted(starts, apex, side="right"))]
+
+    rois = pd.DataFrame({
+        "mz": np.add.reduceat(peak_mz * peak_intensity, starts) / area,
+        "mz_min": np.minimum.reduceat(peak_mz, starts),
+        "mz_max": np.maximum.reduceat(peak_mz, starts),
+        "scan_start": peak_rows[starts],
+        "scan_end": peak_rows[starts + counts - 1],
+        "apex_scan": peak_rows[apex],
+        "n_scans": counts,
+        "max_intensity": max_intensity,
+        "area": area,
+    })[keep].reset_index(drop=True)
+
+    in_kept = np.repeat(keep, counts)
+    roi_offsets = np.zeros(keep.sum() + 1, dtype=np.int64)
+    np.cumsum(counts[keep], out=roi_offsets[1:])
+
+    return rois, roi_offsets, peak_rows[in_kept], peak_intensity[in_kept]
+
+
+def roi_names(rois: pd.DataFrame, retention_time: np.ndarray) -> list[str]:
+    """'roi_<mz>_<apex rt>' names, with a counter appended where two ROIs round to the same name."""
+    names = pd.Series([f"roi_{mz:.4f}_{rt:.2f}" for mz, rt in zip(rois["mz"], retention_time[rois["apex_scan"].to_numpy()])],
+                      dtype=object)
+    repeat = names.groupby(names).cumcount()
+    return [name if n == 0 else f"{name}_{n}" for name, n in zip(names, repeat)]
+
+
+class RoiTraces(TraceMapping):
+    """
+    Mass traces of the detected ROIs over the full scan axis (0 outside the ROI), built
+    on access from the CSR arrays of detect_rois, so thousands of ROIs do not need a
+    dense (n_scans x n_rois) matrix.
+    """
+    def __init__(self,
+                 names: list[str],
+                 scan_id: np.ndarray,
+                 retention_time: np.ndarray,
+                 roi_offsets: np.ndarray,
+                 roi_scan_rows: np.ndarray,
+                 roi_intensity: np.ndarray):
+        super().__init__(names, scan_id, retention_time)
+        self.names = list(names)
+        self.roi_offsets = roi_offsets
+        self.roi_scan_rows = roi_scan_rows
+        self.roi_intensity = roi_intensity
+
+        # position of each original scan row on the retention time sorted axis
+        self._rank = np.empty(len(self._order), dtype=np.int64)
+        self._rank[self._order] = np.arange(len(self._order))
+
+    def __repr__(self):
+        return f"<RoiTraces>:(scans={len(self.retention_time)}, rois={len(self.names)})"
+
+    def intensity(self, i: int) -> np.ndarray:
+        start, end = self.roi_offsets[i], self.roi_offsets[i + 1]
+        trace = np.zeros(len(self.retention_time))
+        trace[self._rank[self.roi_scan_rows[start:end]]] = self.roi_intensity[start:end]
+        return trace
+
+    def _remove_trace(self, i: int):
+        start, end = self.roi_offsets[i], self.roi_offsets[i + 1]
+        self.roi_scan_rows = np.delete(self.roi_scan_rows, np.s_[start:end])
+        self.roi_intensity = np.delete(self.roi_intensity, np.s_[start:end])
+        self.roi_offsets = np.delete(self.roi_offsets, i + 1)
+        self.roi_offsets[i + 1:] -= end - start
+        del self.names[i]
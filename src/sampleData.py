@@ -1,4 +1,5 @@
 #sampleData.py
+from collections.abc import Mapping
 from dataclasses import dataclass, field
 
 import numpy as np
@@ -6,8 +7,16 @@ import pandas as pd
 from pathlib import Path
 from typing import Dict, Any, Optional
 
+from src.preprocess import read_mz_windows, read_scans
+from src.roi_detection import RoiTraces, detect_rois, roi_names
+from src.spectrum_store import MzIndex, SpectrumStore, reduce_scans
+from src.xic_matrix import XicMatrix, aggregate_hits, merge_windows, target_windows, window_hits
+
 # from src.scratch import sampleData
 
+# xic_df prints one line per target up to this many targets, a summary line beyond
+MAX_LISTED_TARGETS = 20
+
 
 def format_data_summary(data: pd.DataFrame | np.ndarray | Dict[str, Any] | None) -> Optional[str]:
     """
@@ -53,7 +62,7 @@ def format_data_summary(data: pd.DataFrame | np.ndarray | Dict[str, Any] | None)
 # -----------------------------------------------------------
 def format_dict_structure(data_dict: Dict[str, Any], indent_level: int = 1) -> str:
     """Recursively formats a dictionary structure."""
-    if data_dict is None or not isinstance(data_dict, dict):
+    if data_dict is None or not isinstance(data_dict, Mapping):
         return f"\t\t Input is not a valid dictionary or is None"
 
     if not data_dict:
@@ -121,14 +130,26 @@ class SampleData:
     species: str | None = None
 
     # ----- Data containers -----
+    cache_path: Path | None = None
     raw: pd.DataFrame | None = None
+    scans: pd.DataFrame | None = None
+    store: SpectrumStore | None = None
+    mz_index: MzIndex | None = field(default=None, repr=False)
     quality_control: pd.DataFrame | None = None
     # baseline_corrected: dict[str, pd.DataFrame] = field(default_factory=dict)   # This can move to quality_control??
-    xic: dict[str, pd.DataFrame] = field(default_factory=dict)
+    xic: XicMatrix = field(default_factory=XicMatrix)
+    rois: pd.DataFrame | None = None
+    roi_traces: RoiTraces | None = None
     unmixed_chromatograms: dict[str, pd.DataFrame] = field(default_factory=dict)
     peaks_properties: dict[str, pd.DataFrame] = field(default_factory=dict)
     window_df_properties: dict[str, pd.DataFrame] = field(default_factory=dict)
 
+    def __setattr__(self, name, value):
+        # the m/z index belongs to the peaks it was built from: new raw or store data invalidates it
+        if name in ("raw", "store"):
+            object.__setattr__(self, "mz_index", None)
+        object.__setattr__(self, name, value)
+
     def summarize(self):
         """Prints a structured summary of the SampleData object contents."""
         print("-" * 60)
@@ -146,13 +167,16 @@ class SampleData:
         print("\n\t--- Data Containers & Shapes ---")
 
         # Define the fields that are simple DataFrames
-        simple_dfs = ['raw', 'quality_control']
+        simple_dfs = ['raw', 'scans', 'quality_control', 'rois']
         for field_name in simple_dfs:
             df = getattr(self, field_name)
             print(f"\t .{field_name:<20} (Shape: {df.shape if df is not None else 'None'})")
             if df is not None and not df.empty:
                 print(f"\t\t {format_data_summary(df)}")
 
+        if self.store is not None:
+            print(f"\t .{'store':<20} {self.store}")
+
         # Define the fields that are Dictionaries of DataFrames
         dict_dfs = ['xic',
                     'unmixed_chromatograms',
@@ -171,10 +195,27 @@ class SampleData:
             return self.xic.copy()
 
         elif chromatogram == 'tic':
-            return {"tic": self.quality_control[["tic"]].copy()}
+            return {"tic": self.quality_control[["retention_time", "tic"]].copy()}
 
         elif chromatogram == "bpc":
-            return {"bpc": self.quality_control[["bpc"]].copy()}
+            return {"bpc": self.quality_control[["retention_time", "bpc"]].copy()}
+
+        elif chromatogram == "roi":
+            return self.roi_traces.copy() if self.roi_traces is not None else {}
+
+        else:
+            raise ValueError(f"Unknown chromatogram type: {chromatogram}")
+
+    def has_chromatograms(self, chromatogram: str) -> bool:
+        """Whether the chromatograms of get_chromatograms were extracted, False e.g. for a sample that failed to load."""
+        if chromatogram == 'xic':
+            return len(self.xic) > 0
+
+        elif chromatogram in ('tic', 'bpc'):
+            return self.quality_control is not None
+
+        elif chromatogram == "roi":
+            return self.roi_traces is not None
 
         else:
             raise ValueError(f"Unknown chromatogram type: {chromatogram}")
@@ -183,6 +224,9 @@ class SampleData:
         if chromatogram == 'xic':
             self.xic[key] = df
 
+        elif chromatogram == 'roi':
+            self.roi_traces[key] = df
+
         elif chromatogram in ('tic', 'bpc'):
             if chromatogram == 'tic':
                 self.quality_control["tic_baseline"] = df["baseline"]
@@ -191,46 +235,165 @@ class SampleData:
                 self.quality_control["bpc_baseline"] = df["baseline"]
                 self.quality_control["bpc_corrected"] = df["corrected"]
 
-    def qc_df(self):
+    def has_spectra(self) -> bool:
+        return self.raw is not None or self.store is not None
+
+    def get_mz_index(self) -> MzIndex:
+        """m/z sorted index of raw (or the store), built on first use and kept until raw or store is reassigned."""
+        if self.mz_index is None:
+            self.mz_index = MzIndex(self.raw["mz"].to_numpy() if self.raw is not None else self.store.mz)
+        return self.mz_index
+
+    def detect_rois(self, ppm: float = 10, min_scans: int = 5, max_gap: int = 1, min_intensity: float = 0, noise: float = 0):
+        """
+        Untargeted ROI (mass trace) detection over all peaks of the sample, see
+        roi_detection.detect_rois. Fills self.rois (one row per ROI, with retention
+        times) and self.roi_traces ({name: (scan_id, retention_time, intensity)}).
+        """
+        scan_base, key = self._scan_base()
+        if self.raw is not None:
+            mz, intensity, peak_keys = self.raw["mz"].to_numpy(), self.raw["intensity"].to_numpy(), self.raw[key].to_numpy()
+        else:
+            mz, intensity = self.store.mz, self.store.intensity
+            peak_keys = np.repeat(np.arange(self.store.n_scans), np.diff(self.store.scan_offsets))
+
+        scan_rows = pd.Index(scan_base[key].to_numpy()).get_indexer(peak_keys)
+        rois, roi_offsets, roi_scan_rows, roi_intensity = detect_rois(mz, intensity, scan_rows, ppm=ppm, min_scans=min_scans,
+                                                                      max_gap=max_gap, min_intensity=min_intensity, noise=noise)
+
+        retention_time = scan_base['retention_time'].to_numpy()
+        rois.insert(0, 'name', roi_names(rois, retention_time))
+        rois['rt_start'] = retention_time[rois['scan_start'].to_numpy(dtype=np.int64)]
+        rois['rt_end'] = retention_time[rois['scan_end'].to_numpy(dtype=np.int64)]
+        rois['rt_apex'] = retention_time[rois['apex_scan'].to_numpy(dtype=np.int64)]
+
+        self.rois = rois
+        self.roi_traces = RoiTraces(rois['name'].tolist(), scan_base['scan_id'].to_numpy(), retention_time,
+                                    roi_offsets, roi_scan_rows, roi_intensity)
+        print(f"\t \033[32m ✓ \033[0m{self.unique_id}: {len(rois)} ROIs")
+
+    def _scan_base(self) -> tuple[pd.DataFrame, str]:
+        """
+        Scans with peaks in raw, (scan_id, retention_time) in scan order, and the column joining
+        them to the peaks: 'scan_id' for the full peak table, 'scan_idx' for a compact one or the store.
+        """
+        if self.raw is not None and 'scan_id' in self.raw.columns:
+            return self.raw[['scan_id', 'retention_time']].drop_duplicates(), 'scan_id'
+
+        scans = self.scans[self.scans['n_peaks'] > 0]
+        return scans[['scan_idx', 'scan_id', 'retention_time']], 'scan_idx'
+
+    def _qc_kernel(self) -> pd.DataFrame:
+        """
+        TIC, BPC, peaks_per_scan and bpc_mz of every scan in raw in one pass: the rows of a
+        scan are contiguous, so the scan boundaries are offsets into the mz/intensity arrays
+        and every reduction is a single ufunc.reduceat (see spectrum_store.reduce_scans).
+        """
+        key = 'scan_id' if 'scan_id' in self.raw.columns else 'scan_idx'
+        codes, scan_keys = pd.factorize(self.raw[key])
+        mz, intensity = self.raw['mz'].to_numpy(), self.raw['intensity'].to_numpy()
+
+        # rows of a scan split over the table, group them (stable, so first-max ties are kept)
+        if len(codes) > 1 and (np.diff(codes) < 0).any():
+            order = np.argsort(codes, kind='stable')
+            codes, mz, intensity = codes[order], mz[order], intensity[order]
+        else:
+            order = slice(None)
 
-        quality_control_base = self.raw[['scan_id', 'retention_time']].drop_duplicates()
-        tic = self.raw.groupby('scan_id')['intensity'].sum().reset_index(name='tic')
-        bpc = self.raw.groupby('scan_id')['intensity'].max().reset_index(name='bpc')
-        pps = self.raw.groupby('scan_id').size().rename('peaks_per_scan').reset_index()
-        bpc_mz = (self.raw.loc[self.raw.groupby('scan_id')['intensity'].idxmax(), ['scan_id', 'mz']].reset_index(drop=True).rename(columns={'mz': 'bpc_mz'}))
-
-        self.quality_control = (
-            quality_control_base
-            .merge(tic, on='scan_id')
-            .merge(bpc, on='scan_id')
-            .merge(pps, on='scan_id')
-            .merge(bpc_mz, on='scan_id')
-        )
-        print(f"\t \033[32m ✓ \033[0m{self.unique_id}")
+        scan_offsets = np.searchsorted(codes, np.arange(len(scan_keys) + 1))
+        _, tic, bpc, pps, bpc_mz = reduce_scans(mz, intensity, scan_offsets)
 
-    def xic_df(self, target_list, tol, tol_type):
-        print(f"\t  {self.unique_id} --> {target_list}")
-        for metabolite, mz_value in target_list.items():
-            # print(f"\t * Extracting metabolite target {metabolite} with mz of {mz_value}")
-            if tol_type == "da":
-                tol = tol
-            elif tol_type == "ppm":
-                tol = tol * mz_value / 1e6
-
-            xic_df_mz = self.raw[
-                (self.raw["mz"] >= mz_value - tol) &
-                (self.raw["mz"] <= mz_value + tol)].copy()
-
-            if len(xic_df_mz) > 0:
-                print(f"\t\t \033[32m ✓ \033[0m{metabolite} ({mz_value}): tol={tol:.6f} Da, hits={len(xic_df_mz)}")
-            else:
-                print(f"\t\t \033[31m x \033[0m{metabolite} ({mz_value}): tol={tol:.6f} Da, hits={len(xic_df_mz)}")
+        if key == 'scan_id':
+            scan_id = np.asarray(scan_keys)
+            retention_time = self.raw['retention_time'].to_numpy()[order][scan_offsets[:-1]]
+        else:
+            scans = self.scans.set_index('scan_idx').loc[np.asarray(scan_keys)]
+            scan_id, retention_time = scans['scan_id'].to_numpy(), scans['retention_time'].to_numpy()
+
+        return pd.DataFrame({
+            'scan_id': scan_id,
+            'retention_time': retention_time,
+            'tic': tic,
+            'bpc': bpc,
+            'peaks_per_scan': pps,
+            'bpc_mz': bpc_mz,
+        })
 
-            xic_df_base = self.raw[['scan_id', 'retention_time']].drop_duplicates()
+    def qc_df(self):
+        if self.raw is None and self.store is not None:
+            self.quality_control = self.store.quality_control()
+            print(f"\t \033[32m ✓ \033[0m{self.unique_id}")
+            return
+
+        self.quality_control = self._qc_kernel()
+        print(f"\t \033[32m ✓ \033[0m{self.unique_id}")
 
-            xic_df = xic_df_base.merge(xic_df_mz[['scan_id', 'intensity']], on='scan_id', how='left')
-            xic_df['intensity'] = xic_df['intensity'].fillna(0)
-            xic_df = xic_df.sort_values('retention_time').reset_index(drop=True)
+    def xic_df(self, target_list, tol, tol_type, from_cache: bool = False, aggregation: str = "sum",
+               windows: tuple[np.ndarray, np.ndarray] | None = None):
+        """
+        Extracts the XIC of every target m/z in one batch into self.xic, an XicMatrix of
+        (n_scans x n_targets). Peaks of one scan inside a window are reduced with
+        'aggregation' ('sum' or 'max'). from_cache=True reads the m/z windows from the
+        parquet cache in one read with predicate pushdown instead of searching self.raw;
+        overlapping windows (e.g. isotopes and adducts of a compound library) are merged first.
+        windows takes precomputed (lower, upper) bounds in target_list order, such as
+        those of a CompoundLibrary, instead of deriving them from tol.
+        """
+        print(f"\t  {self.unique_id} --> {target_list if len(target_list) <= MAX_LISTED_TARGETS else f'{len(target_list)} targets'}")
+
+        if from_cache:
+            scans = read_scans(self.cache_path)
+            xic_df_base, key = scans.loc[scans['n_peaks'] > 0, ['scan_idx', 'scan_id', 'retention_time']], 'scan_idx'
+        else:
+            xic_df_base, key = self._scan_base()
+
+        lower, upper = windows if windows is not None else target_windows(target_list, tol, tol_type)
+
+        if from_cache:
+            # one read for all merged intervals; filtering on disjoint intervals instead of
+            # the raw windows keeps every peak once, even where windows overlap
+            interval_lower, interval_upper, _ = merge_windows(lower, upper)
+            hits = read_mz_windows(self.cache_path, interval_lower, interval_upper, columns=['scan_idx', 'intensity', 'mz'])
+
+            rows, target_ids = window_hits(MzIndex(hits['mz'].to_numpy(dtype=np.float64)), lower, upper)
+            peak_keys = hits[key].to_numpy()[rows]
+            intensity = hits['intensity'].to_numpy()[rows]
+        elif self.raw is None:
+            # rows are peak positions in the store; their scan is found from the scan offsets
+            rows, target_ids = window_hits(self.get_mz_index(), lower, upper)
+            peak_keys = np.searchsorted(self.store.scan_offsets, rows, side='right') - 1
+            intensity = np.asarray(self.store.intensity[rows])
+        else:
+            rows, target_ids = window_hits(self.get_mz_index(), lower, upper)
+            peak_keys = self.raw[key].to_numpy()[rows]
+            intensity = self.raw['intensity'].to_numpy()[rows]
 
-            self.xic[metabolite] = xic_df
+        scan_rows = pd.Index(xic_df_base[key].to_numpy()).get_indexer(peak_keys)
+        matrix = aggregate_hits(scan_rows, target_ids, intensity, len(xic_df_base), len(target_list), aggregation)
 
+        hits = np.bincount(target_ids.astype(np.int64), minlength=len(target_list))
+        if len(target_list) > MAX_LISTED_TARGETS:
+            print(f"\t\t \033[32m ✓ \033[0m{np.count_nonzero(hits)} of {len(target_list)} targets with hits, {hits.sum()} peaks")
+        else:
+            for (metabolite, mz_value), n_hits, mz_min, mz_max in zip(target_list.items(), hits, lower, upper):
+                mark = "\033[32m ✓ \033[0m" if n_hits > 0 else "\033[31m x \033[0m"
+                print(f"\t\t {mark}{metabolite} ({mz_value}): tol={(mz_max - mz_min) / 2:.6f} Da, hits={n_hits}")
+
+        self.xic = XicMatrix(list(target_list), xic_df_base['scan_id'].to_numpy(), xic_df_base['retention_time'].to_numpy(),
+                             matrix, aggregation)
+
+    def xic_payload(self, from_cache: bool = False) -> "SampleData":
+        """
+        Lightweight copy holding only what xic_df reads, to send to a worker process:
+        the cache path with from_cache=True, else raw (with its m/z index) or the store.
+        """
+        if from_cache:
+            return SampleData(unique_id=self.unique_id, cache_path=self.cache_path)
+        return SampleData(unique_id=self.unique_id, cache_path=self.cache_path, raw=self.raw, scans=self.scans,
+                          store=self.store, mz_index=self.mz_index)
+
+
+def extract_sample_xic(sampleData: SampleData, **xic_kwargs) -> XicMatrix:
+    """Thread/process pool entry point, runs xic_df on one sample and returns its XIC matrix."""
+    sampleData.xic_df(**xic_kwargs)
+    return sampleData.xic
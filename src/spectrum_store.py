@@ -0,0 +1,219 @@
+"""
+Memory-mapped CSR (compressed sparse row) store of a sample's spectra.
+
+All peaks are kept in two flat arrays, scan after scan, and the peaks of scan i
+are mz[scan_offsets[i]:scan_offsets[i + 1]]. Every array is a .npy file opened
+with np.load(mmap_mode="r"), so loading a sample takes near-constant time and
+memory, and processes reading the same store share the OS page cache.
+
+    <name>.spectra/
+        mz.npy, intensity.npy                       flat peak arrays
+        scan_offsets.npy                            n_scans + 1 peak offsets
+        scan_id.npy, retention_time.npy, ms_level.npy   per scan
+"""
+import shutil
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+PEAK_ARRAYS = ("mz", "intensity")
+SCAN_ARRAYS = ("scan_id", "retention_time", "ms_level")
+
+
+def store_path(parquet_path: Path) -> Path:
+    """Path of the spectrum store built next to a parquet cache."""
+    return parquet_path.with_suffix(".spectra")
+
+
+def reduce_scans(mz: np.ndarray, intensity: np.ndarray, scan_offsets: np.ndarray) -> tuple[np.ndarray, ...]:
+    """
+    Per-scan TIC, BPC, peak count and base peak m/z in one pass of ufunc.reduceat over
+    the scan boundaries. scan_offsets holds the n_scans + 1 boundaries of the peaks in
+    mz/intensity (the first one may be non-zero for a slice of a larger store).
+
+    Returns (has_peaks, tic, bpc, peaks_per_scan, bpc_mz), the last four only for
+    the scans where has_peaks is True, as empty scans have no rows in the peak table.
+    """
+    scan_offsets = np.asarray(scan_offsets, dtype=np.int64)
+    intensity = np.asarray(intensity)
+    mz = np.asarray(mz)
+
+    counts = np.diff(scan_offsets)
+    has_peaks = counts > 0
+    counts = counts[has_peaks]
+    starts = scan_offsets[:-1][has_peaks] - scan_offsets[0]
+
+    if not len(starts):
+        empty = np.empty(0, dtype=intensity.dtype)
+        return has_peaks, empty, empty, counts, np.empty(0, dtype=mz.dtype)
+
+    # accumulate in float64 like pandas' groupby sum, then return the intensity dtype
+    tic = np.add.reduceat(intensity, starts, dtype=np.float64).astype(intensity.dtype, copy=False)
+    bpc = np.maximum.reduceat(intensity, starts)
+
+    # first position of the maximum in each scan, same tie-breaking as idxmax
+    max_pos = np.flatnonzero(intensity == np.repeat(bpc, counts))
+    max_scan = np.searchsorted(starts, max_pos, side="right") - 1
+    first = np.ones(len(max_pos), dtype=bool)
+    first[1:] = max_scan[1:] != max_scan[:-1]
+    bpc_mz = mz[max_pos[first]]
+
+    return has_peaks, tic, bpc, counts, bpc_mz
+
+
+class SpectrumStore:
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+        for name in PEAK_ARRAYS + SCAN_ARRAYS + ("scan_offsets",):
+            setattr(self, name, np.load(self.path / f"{name}.npy", mmap_mode="r"))
+
+    def __reduce__(self):
+        # memmaps would be pickled by value, hand workers the path and let them map the files again
+        return SpectrumStore, (self.path,)
+
+    def __repr__(self):
+        return f"<SpectrumStore>:(path={self.path.name}, scans={self.n_scans}, peaks={self.n_peaks})"
+
+    @property
+    def n_scans(self) -> int:
+        return len(self.scan_offsets) - 1
+
+    @property
+    def n_peaks(self) -> int:
+        return int(self.scan_offsets[-1])
+
+    @property
+    def scans(self) -> pd.DataFrame:
+        """Per-scan table, same columns as the parquet cache side table."""
+        return pd.DataFrame({
+            "scan_idx": np.arange(self.n_scans, dtype=np.int32),
+            "scan_id": np.asarray(self.scan_id),
+            "retention_time": np.asarray(self.retention_time),
+            "ms_level": np.asarray(self.ms_level),
+            "n_peaks": np.diff(self.scan_offsets),
+        })
+
+    @classmethod
+    def write(cls,
+              path: str | Path,
+              scans: pd.DataFrame,
+              chunks: Iterable[tuple[np.ndarray, np.ndarray]]) -> "SpectrumStore":
+        """
+        Writes a store from the per-scan table (scan order, with n_peaks) and an iterable
+        of (mz, intensity) chunks in scan order. Only one chunk is held in memory.
+        The store is written to a temporary directory and moved in place when complete.
+        """
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+
+        scan_offsets = np.zeros(len(scans) + 1, dtype=np.int64)
+        np.cumsum(scans["n_peaks"].to_numpy(), out=scan_offsets[1:])
+        n_peaks = int(scan_offsets[-1])
+
+        np.save(tmp_path / "scan_offsets.npy", scan_offsets)
+        np.save(tmp_path / "scan_id.npy", scans["scan_id"].to_numpy().astype(str) if scans["scan_id"].dtype == object else scans["scan_id"].to_numpy())
+        np.save(tmp_path / "retention_time.npy", scans["retention_time"].to_numpy(dtype=np.float64))
+        np.save(tmp_path / "ms_level.npy", scans["ms_level"].to_numpy(dtype=np.int64))
+
+        peak_arrays, position = None, 0
+        for mz, intensity in chunks:
+            if peak_arrays is None:
+                peak_arrays = {
+                    name: np.lib.format.open_memmap(tmp_path / f"{name}.npy", mode="w+", dtype=values.dtype, shape=(n_peaks,))
+                    for name, values in zip(PEAK_ARRAYS, (mz, intensity))
+                }
+            peak_arrays["mz"][position:position + len(mz)] = mz
+            peak_arrays["intensity"][position:position + len(mz)] = intensity
+            position += len(mz)
+
+        if position != n_peaks:
+            raise ValueError(f"Spectrum store expected {n_peaks} peaks, chunks held {position}")
+
+        if peak_arrays is None:
+            np.save(tmp_path / "mz.npy", np.empty(0, dtype=np.float64))
+            np.save(tmp_path / "intensity.npy", np.empty(0, dtype=np.float32))
+        else:
+            for array in peak_arrays.values():
+                array.flush()
+            del peak_arrays
+
+        shutil.rmtree(path, ignore_errors=True)
+        tmp_path.rename(path)
+        return cls(path)
+
+    def _scan_blocks(self, block_size: int):
+        """Yields (first_scan, last_scan + 1) ranges holding about block_size peaks each."""
+        bounds = np.searchsorted(self.scan_offsets, np.arange(0, self.n_peaks, block_size), side="right") - 1
+        bounds = np.unique(np.concatenate([[0], bounds, [self.n_scans]]))
+        yield from zip(bounds[:-1], bounds[1:])
+
+    def quality_control(self, block_size: int = 4_000_000) -> pd.DataFrame:
+        """
+        TIC, BPC, peaks_per_scan and bpc_mz of every scan with peaks, the same frame as
+        SampleData.qc_df. Peaks are reduced in blocks so memory stays bounded.
+        """
+        parts = []
+        for first, last in self._scan_blocks(block_size):
+            offsets = np.asarray(self.scan_offsets[first:last + 1])
+            peaks = slice(offsets[0], offsets[-1])
+            has_peaks, tic, bpc, pps, bpc_mz = reduce_scans(self.mz[peaks], self.intensity[peaks], offsets)
+            scan_idx = np.arange(first, last)[has_peaks]
+            parts.append(pd.DataFrame({
+                "scan_id": np.asarray(self.scan_id[scan_idx]),
+                "retention_time": np.asarray(self.retention_time[scan_idx]),
+                "tic": tic,
+                "bpc": bpc,
+                "peaks_per_scan": pps,
+                "bpc_mz": bpc_mz,
+            }))
+
+        if not parts:
+            return pd.DataFrame(columns=["scan_id", "retention_time", "tic", "bpc", "peaks_per_scan", "bpc_mz"])
+
+        return pd.concat(parts, ignore_index=True)
+
+    def mz_window(self, mz_min: float, mz_max: float, block_size: int = 4_000_000) -> pd.DataFrame:
+        """Peaks with mz_min <= mz <= mz_max as (scan_idx, intensity, mz), in scan order."""
+        positions = []
+        for start in range(0, self.n_peaks, block_size):
+            mz = self.mz[start:start + block_size]
+            positions.append(np.flatnonzero((mz >= mz_min) & (mz <= mz_max)) + start)
+
+        positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+        return pd.DataFrame({
+            "scan_idx": (np.searchsorted(self.scan_offsets, positions, side="right") - 1).astype(np.int32),
+            "intensity": np.asarray(self.intensity[positions]),
+            "mz": np.asarray(self.mz[positions]),
+        })
+
+
+class MzIndex:
+    """
+    The peaks of a sample sorted by m/z, built once with a stable argsort. 'order' maps
+    each sorted position back to its row in the source arrays, so the peaks inside any
+    m/z window are found with two np.searchsorted calls instead of a full mask.
+    """
+    def __init__(self, mz: np.ndarray):
+        mz = np.asarray(mz)
+        self.order = np.argsort(mz, kind="stable")
+        self.mz = mz[self.order]
+
+    def __len__(self) -> int:
+        return len(self.mz)
+
+    def __repr__(self):
+        return f"<MzIndex>:(peaks={len(self)})"
+
+    def bounds(self, mz_min, mz_max) -> tuple[np.ndarray, np.ndarray]:
+        """Sorted positions [start, end) of the peaks with mz_min <= mz <= mz_max, scalars or arrays of windows."""
+        return np.searchsorted(self.mz, mz_min, side="left"), np.searchsorted(self.mz, mz_max, side="right")
+
+    def window(self, mz_min: float, mz_max: float) -> np.ndarray:
+        """Source rows of the peaks with mz_min <= mz <= mz_max, in source order."""
+        start, end = self.bounds(mz_min, mz_max)
+        return np.sort(self.order[start:end])
@@ -0,0 +1,85 @@
+"""
+Quality control and XIC traces accumulated while the spectra of a file are read,
+so a sample's peak table never has to be built or loaded when only TIC, BPC,
+bpc_mz, peaks_per_scan and the target XICs are needed.
+"""
+import numpy as np
+import pandas as pd
+
+from src.xic_matrix import AGGREGATIONS, XicMatrix, target_windows
+
+QC_COLUMNS = ["scan_id", "retention_time", "tic", "bpc", "peaks_per_scan", "bpc_mz"]
+
+
+class ScanAccumulator:
+    """
+    Collects per-scan QC values and the summed (or max) intensity of every target m/z window,
+    one spectrum at a time. Feed it the (scan_id, retention_time, ms_level, mz, intensity)
+    tuples of MzmlParser.iter_spectra; memory grows with the number of scans, not peaks.
+    """
+    def __init__(self, target_list: dict[str, float] | None = None, tol: float = 3, tol_type: str = "ppm", aggregation: str = "sum"):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown XIC aggregation: {aggregation}")
+
+        self.targets = list(target_list or {})
+        self.lower, self.upper = target_windows(target_list or {}, tol, tol_type)
+        self.aggregation = aggregation
+
+        self._scan_ids, self._retention_times = [], []
+        self._tic, self._bpc, self._pps, self._bpc_mz = [], [], [], []
+        self._xic = []
+
+    def __len__(self) -> int:
+        return len(self._scan_ids)
+
+    def add(self, scan_id, retention_time: float, ms_level: int, mz: np.ndarray, intensity: np.ndarray):
+        # scans without peaks have no rows in the peak table, leave them out like qc_df does
+        if not len(mz):
+            return
+
+        self._scan_ids.append(scan_id)
+        self._retention_times.append(retention_time)
+
+        # same values as spectrum_store.reduce_scans: float64 sum in the intensity dtype, first max
+        self._tic.append(intensity.sum(dtype=np.float64).astype(intensity.dtype))
+        base_peak = int(np.argmax(intensity))
+        self._bpc.append(intensity[base_peak])
+        self._pps.append(len(mz))
+        self._bpc_mz.append(mz[base_peak])
+
+        if self.targets:
+            self._xic.append(self._window_sums(mz, intensity))
+
+    def _window_sums(self, mz: np.ndarray, intensity: np.ndarray) -> np.ndarray:
+        """Summed (or max) intensity of the peaks with lower <= mz <= upper, for every target window."""
+        if len(mz) > 1 and (mz[1:] < mz[:-1]).any():
+            order = np.argsort(mz, kind="stable")
+            mz, intensity = mz[order], intensity[order]
+
+        starts = np.searchsorted(mz, self.lower, side="left")
+        ends = np.searchsorted(mz, self.upper, side="right")
+
+        # reduceat over (start, end) pairs sums intensity[start:end]; a trailing 0 keeps end == len(mz) valid
+        bounds = np.column_stack([starts, ends]).ravel()
+        ufunc = np.add if self.aggregation == "sum" else np.maximum
+        values = ufunc.reduceat(np.append(intensity, 0).astype(np.float64), bounds)[::2]
+        return np.where(ends > starts, values, 0.0)
+
+    def quality_control(self) -> pd.DataFrame:
+        """The same frame as SampleData.qc_df for the scans added so far."""
+        if not self._scan_ids:
+            return pd.DataFrame(columns=QC_COLUMNS)
+
+        return pd.DataFrame({
+            "scan_id": np.asarray(self._scan_ids),
+            "retention_time": np.asarray(self._retention_times, dtype=np.float64),
+            "tic": np.asarray(self._tic),
+            "bpc": np.asarray(self._bpc),
+            "peaks_per_scan": np.asarray(self._pps, dtype=np.int64),
+            "bpc_mz": np.asarray(self._bpc_mz),
+        })
+
+    def xic(self) -> XicMatrix:
+        """The (n_scans x n_targets) XIC matrix of the scans added so far, same values as SampleData.xic_df."""
+        matrix = np.vstack(self._xic) if self._xic else np.zeros((len(self), len(self.targets)))
+        return XicMatrix(self.targets, np.asarray(self._scan_ids), self._retention_times, matrix, self.aggregation)
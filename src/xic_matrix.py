@@ -0,0 +1,188 @@
+"""
+Batch XIC extraction into one (n_scans x n_targets) intensity matrix.
+
+The peaks of every target window are gathered in one pass (two np.searchsorted
+calls over an m/z sorted index for all windows at once) and reduced per
+(scan, target) with a single bincount ('sum') or maximum.at ('max'), so a scan
+with several peaks inside a window gives one value instead of duplicate rows.
+XicMatrix exposes the columns as the usual {target: DataFrame} mapping.
+"""
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+
+import numpy as np
+import pandas as pd
+
+from src.spectrum_store import MzIndex
+
+AGGREGATIONS = ("sum", "max")
+
+
+def target_windows(target_list: dict[str, float], tol: float, tol_type: str) -> tuple[np.ndarray, np.ndarray]:
+    """Lower and upper m/z bounds of every target, with a ppm tolerance scaled by each target's own m/z."""
+    mz_values = np.fromiter(target_list.values(), dtype=np.float64, count=len(target_list))
+    if tol_type == "da":
+        tolerances = np.full(len(mz_values), float(tol))
+    elif tol_type == "ppm":
+        tolerances = float(tol) * mz_values / 1e6
+    else:
+        raise ValueError(f"Unknown tolerance type: {tol_type}")
+    return mz_values - tolerances, mz_values + tolerances
+
+
+def merge_windows(lower: np.ndarray, upper: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merges overlapping [lower, upper] windows into sorted, disjoint intervals.
+    Returns (interval_lower, interval_upper, interval of every window).
+    """
+    lower, upper = np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64)
+    order = np.argsort(lower, kind="stable")
+    if not len(order):
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+
+    sorted_lower, running_upper = lower[order], np.maximum.accumulate(upper[order])
+    # a window opens a new interval when it starts after everything before it has ended
+    opens = np.r_[True, sorted_lower[1:] > running_upper[:-1]]
+    interval_sorted = np.cumsum(opens) - 1
+
+    interval = np.empty(len(order), dtype=np.int64)
+    interval[order] = interval_sorted
+    ends = np.r_[np.flatnonzero(opens)[1:], len(order)] - 1
+    return sorted_lower[opens], running_upper[ends], interval
+
+
+def window_hits(index: MzIndex, lower: np.ndarray, upper: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Source rows of the peaks inside every window and the window (target) each belongs
+    to, target after target and in m/z order within a target. Overlapping windows
+    share peaks.
+    """
+    starts, ends = index.bounds(lower, upper)
+    counts = np.maximum(ends - starts, 0)
+    target_ids = np.repeat(np.arange(len(starts)), counts)
+
+    # positions starts[t] .. ends[t] - 1 of every window, concatenated without a Python loop
+    first = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=first[1:])
+    positions = np.arange(counts.sum()) - np.repeat(first - starts, counts)
+
+    return index.order[positions], target_ids
+
+
+def aggregate_hits(scan_rows: np.ndarray,
+                   target_ids: np.ndarray,
+                   intensity: np.ndarray,
+                   n_scans: int,
+                   n_targets: int,
+                   aggregation: str = "sum") -> np.ndarray:
+    """
+    Reduces the hit intensities into a (n_scans x n_targets) float64 matrix, 0 where a
+    scan has no peak in a window. Hits are summed in the order given, pass them in
+    m/z order within each target to get the same values from every data source.
+    """
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown XIC aggregation: {aggregation}")
+
+    flat = np.asarray(scan_rows, dtype=np.int64) * n_targets + np.asarray(target_ids, dtype=np.int64)
+    values = np.asarray(intensity, dtype=np.float64)
+    if aggregation == "sum":
+        matrix = np.bincount(flat, weights=values, minlength=n_scans * n_targets)
+    else:
+        matrix = np.zeros(n_scans * n_targets)
+        np.maximum.at(matrix, flat, values)
+
+    return matrix.reshape(n_scans, n_targets)
+
+
+class TraceMapping(MutableMapping, ABC):
+    """
+    {name: (scan_id, retention_time, intensity) frame} view over traces that share one
+    scan axis, sorted by retention time. Subclasses store the intensities, return trace i
+    from intensity(i) and drop it with _remove_trace(i). Frames assigned with
+    traces[name] = df (e.g. baseline corrected traces) are kept as they are and take
+    precedence over the stored trace.
+    """
+    def __init__(self, names: list[str], scan_id: np.ndarray | None, retention_time: np.ndarray | None):
+        retention_time = np.asarray(retention_time if retention_time is not None else [], dtype=np.float64)
+        self._order = np.argsort(retention_time, kind="stable")
+
+        self.retention_time = retention_time[self._order]
+        self.scan_id = np.asarray(scan_id if scan_id is not None else [])[self._order]
+
+        self._columns = {name: i for i, name in enumerate(names)}
+        self._frames: dict[str, pd.DataFrame] = {}
+
+    @abstractmethod
+    def intensity(self, i: int) -> np.ndarray:
+        """Intensities of stored trace i on the retention time sorted scan axis."""
+
+    @abstractmethod
+    def _remove_trace(self, i: int):
+        """Removes stored trace i; the traces after it move down one position."""
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        if name in self._frames:
+            return self._frames[name]
+        if name not in self._columns:
+            raise KeyError(name)
+        return pd.DataFrame({
+            "scan_id": self.scan_id,
+            "retention_time": self.retention_time,
+            "intensity": self.intensity(self._columns[name]),
+        })
+
+    def __setitem__(self, name: str, df: pd.DataFrame):
+        self._frames[name] = df
+
+    def __delitem__(self, name: str):
+        if name not in self:
+            raise KeyError(name)
+        self._frames.pop(name, None)
+        if name in self._columns:
+            i = self._columns.pop(name)
+            self._remove_trace(i)
+            self._columns = {other: j - (j > i) for other, j in self._columns.items()}
+
+    def __iter__(self):
+        yield from self._columns
+        yield from (name for name in self._frames if name not in self._columns)
+
+    def __len__(self) -> int:
+        return len(self._columns) + sum(name not in self._columns for name in self._frames)
+
+    def __contains__(self, name) -> bool:
+        return name in self._columns or name in self._frames
+
+    def copy(self) -> dict[str, pd.DataFrame]:
+        """Plain {name: DataFrame} dict of every trace, like dict.copy() on the former xic dict."""
+        return {name: self[name] for name in self}
+
+
+class XicMatrix(TraceMapping):
+    """
+    XIC traces of a sample as one (n_scans x n_targets) matrix with the scan rows
+    sorted by retention time. Reading xic[target] gives the usual (scan_id,
+    retention_time, intensity) frame built from the matrix column.
+    """
+    def __init__(self,
+                 targets: list[str] | None = None,
+                 scan_id: np.ndarray | None = None,
+                 retention_time: np.ndarray | None = None,
+                 matrix: np.ndarray | None = None,
+                 aggregation: str = "sum"):
+        self.targets = list(targets or [])
+        super().__init__(self.targets, scan_id, retention_time)
+
+        self.matrix = (np.asarray(matrix, dtype=np.float64) if matrix is not None
+                       else np.zeros((0, len(self.targets))))[self._order]
+        self.aggregation = aggregation
+
+    def __repr__(self):
+        return f"<XicMatrix>:(scans={self.matrix.shape[0]}, targets={len(self.targets)}, aggregation={self.aggregation})"
+
+    def intensity(self, i: int) -> np.ndarray:
+        return self.matrix[:, i]
+
+    def _remove_trace(self, i: int):
+        self.matrix = np.delete(self.matrix, i, axis=1)
+        del self.targets[i]
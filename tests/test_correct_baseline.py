@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+from src.ionome_core import Ionome
+from src.sampleData import SampleData
+from src.xic_matrix import XicMatrix
+
+N_SCANS = 200
+
+
+def loaded_sample(uid: str, seed: int) -> SampleData:
+    """A sample as load_data, extract_quality_control and extract_ion_chromatograms leave it."""
+    rng = np.random.default_rng(seed)
+    retention_time = np.linspace(0, 10, N_SCANS)
+    peak = 1e5 * np.exp(-0.5 * ((retention_time - 5) / 0.2) ** 2)
+    intensity = 1e3 + peak + rng.normal(0, 10, (2, N_SCANS))
+
+    sampleData = SampleData(unique_id=uid)
+    sampleData.quality_control = pd.DataFrame({"retention_time": retention_time, "tic": intensity[0], "bpc": intensity[1]})
+    sampleData.xic = XicMatrix(["catechin", "epicatechin"], np.arange(N_SCANS), retention_time, intensity.T)
+    return sampleData
+
+
+def make_ionome(workers: int) -> Ionome:
+    """Ionome with two loaded samples and one whose load failed (no spectra, QC or XICs)."""
+    ionome = Ionome.__new__(Ionome)
+    ionome.config = yaml.safe_load(open("config/config.yaml"))
+    ionome.config["baseline"].update(workers=workers, cache=False)
+    ionome._method = ionome.config["baseline"].get("method", "asls")
+    ionome.samples = {
+        "T_a_1": loaded_sample("T_a_1", seed=0),
+        "T_bad_1": SampleData(unique_id="T_bad_1"),
+        "T_b_1": loaded_sample("T_b_1", seed=1),
+    }
+    return ionome
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("chromatogram", ["tic", "bpc", "xic"])
+def test_correct_baseline_skips_failed_samples(chromatogram, workers):
+    ionome = make_ionome(workers)
+
+    failed = ionome.correct_baseline(chromatogram)
+
+    assert list(failed) == ["T_bad_1"]
+    assert ionome.samples["T_bad_1"].quality_control is None
+    assert len(ionome.samples["T_bad_1"].xic) == 0
+
+    for uid in ("T_a_1", "T_b_1"):
+        sampleData = ionome.samples[uid]
+        if chromatogram in ("tic", "bpc"):
+            assert f"{chromatogram}_corrected" in sampleData.quality_control.columns
+        elif chromatogram == "xic":
+            assert all("corrected" in xic_df.columns for xic_df in sampleData.xic.values())
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from src.roi_detection import detect_rois
+
+TRACE_MZ = [600.0, 700.0, 800.0, 900.0]
+
+
+def dense_run(n_scans: int = 300, n_background: int = 6000, seed: int = 0):
+    """
+    Centroids of a full-scan run with a dense random background, so the m/z sorted centroids
+    of all scans are almost never more than a few ppm apart, and four +-2 ppm traces over
+    scans 50..150. Returns (mz, intensity, scan_rows).
+    """
+    rng = np.random.default_rng(seed)
+    mz, intensity, scan_rows = [], [], []
+    for row in range(n_scans):
+        mz.append(rng.uniform(100, 1000, n_background))
+        intensity.append(rng.uniform(100, 500, n_background))
+        scan_rows.append(np.full(n_background, row))
+        if 50 <= row <= 150:
+            mz.append(np.array(TRACE_MZ) * (1 + rng.uniform(-2e-6, 2e-6, len(TRACE_MZ))))
+            intensity.append(np.full(len(TRACE_MZ), 1e5 * np.exp(-0.5 * ((row - 100) / 15) ** 2) + 1e3))
+            scan_rows.append(np.full(len(TRACE_MZ), row))
+    return np.concatenate(mz), np.concatenate(intensity), np.concatenate(scan_rows)
+
+
+def test_traces_in_dense_background_are_one_roi_each():
+    mz, intensity, scan_rows = dense_run()
+
+    rois, roi_offsets, roi_scan_rows, roi_intensity = detect_rois(mz, intensity, scan_rows, ppm=10, min_scans=5,
+                                                                  max_gap=1, min_intensity=5000)
+
+    assert len(rois) == len(TRACE_MZ)
+    rois = rois.sort_values("mz", ignore_index=True)
+    assert rois["mz"].to_numpy() == pytest.approx(TRACE_MZ, rel=2e-6)
+    # a background centroid may extend a trace by a scan or two on either side
+    assert (rois["scan_start"] <= 50).all() and (rois["scan_start"] >= 47).all()
+    assert (rois["scan_end"] >= 150).all() and (rois["scan_end"] <= 153).all()
+    assert (rois["apex_scan"] == 100).all()
+
+    assert roi_offsets[-1] == len(roi_scan_rows) == len(roi_intensity) == rois["n_scans"].sum()
+
+
+def test_min_scans_max_gap_and_noise():
+    # one trace with a two scan gap, a three scan trace and a trace below the noise level
+    scan_rows = np.r_[0:5, 7:12, 0:3, 0:10]
+    mz = np.r_[np.full(10, 300.0), np.full(3, 400.0), np.full(10, 500.0)]
+    intensity = np.r_[np.full(10, 1e4), np.full(3, 1e4), np.full(10, 50.0)]
+
+    rois = detect_rois(mz, intensity, scan_rows, ppm=10, min_scans=4, max_gap=1, noise=100)[0]
+    assert rois[["mz", "scan_start", "scan_end"]].values.tolist() == [[300.0, 0, 4], [300.0, 7, 11]]
+
+    rois = detect_rois(mz, intensity, scan_rows, ppm=10, min_scans=4, max_gap=2, noise=100)[0]
+    assert rois[["mz", "scan_start", "scan_end", "n_scans"]].values.tolist() == [[300.0, 0, 11, 10]]